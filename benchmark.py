@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Benchmark the execution backends on the programs in prog/.
+
+usage:
+    python benchmark.py                     run, print report
+    python benchmark.py --save              ... and store as new baseline
+    python benchmark.py --check             ... and fail on regressions
+
+Every (program, backend) pair runs in a fresh python process, so peak RSS
+and startup time (process start to first instruction, including import,
+parsing and compiling) are measured per pair. Programs that never stop are
+cut off after a fixed number of output bytes. The startup of the command
+line ("python -m iBrainfuck run") is measured as well.
+
+Throughput is given in IR ops per second: the number of IR ops the "ir"
+backend executes for a program is taken as the amount of work for that
+program on every backend.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import iBrainfuck
+
+PROG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prog")
+BASELINE = "bench_baseline.json"
+
+
+def _read_prog(name):
+    """Return source of prog/name."""
+    with open(os.path.join(PROG_DIR, name)) as progfile:
+        return progfile.read()
+
+
+# program: (input, output bytes to stop after or None)
+BENCHMARKS = {
+             "e.b": (b"", 60),
+             "random.b": (b"", 40),
+             "bsort.b": (b"the quick brown fox jumps over the lazy dog",
+                         None),
+             "isort.b": (b"the quick brown fox jumps over the lazy dog",
+                         None),
+             "xmastree.b": (b"40", None),
+             "jabh.b": (b"", None),
+             "dbfi.b": (lambda: _read_prog("isort.b").replace("!", "")
+                        .encode() + b"!bf", None),
+             "dbf2c.b": (lambda: _read_prog("bsort.b").encode(), None)
+             }
+
+
+class bench_stop(Exception):
+    """Enough output, stop the program."""
+
+
+def run_child(name, backend):
+    """Run one benchmark in this process, return its measurements."""
+    inp, stop_after = BENCHMARKS[name]
+    if callable(inp):
+        inp = inp()
+    output = bytearray()
+
+    def sink(chunk):
+        output.extend(chunk)
+        if stop_after is not None and len(output) >= stop_after:
+            raise bench_stop()
+
+    prog = iBrainfuck.bf_program(_read_prog(name), source=inp,
+                                 sink=iBrainfuck.byte_sink(sink, "always"))
+    prog.parse_code()
+    prog.compile_ir()
+    if backend == "c" and prog.compile_c() is None:
+        return {"error": "no C compiler"}
+    if backend == "python":
+        prog.compile_python()
+
+    first_instruction = time.time()
+    start = time.perf_counter()
+    try:
+        prog.run(backend, verbose=False)
+    except bench_stop:
+        pass
+    wall = time.perf_counter() - start
+    return {
+           "first_instruction": first_instruction,
+           "wall": wall,
+           "steps": prog.steps,
+           "output": len(output),
+           "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+           }
+
+
+def measure(name, backend):
+    """Run one benchmark in a fresh process, return its measurements."""
+    spawned = time.time()
+    result = subprocess.run([sys.executable, os.path.abspath(__file__),
+                             "--child", name, backend],
+                            capture_output=True, text=True)
+    if result.returncode:
+        return {"error": result.stderr.strip().splitlines()[-1]}
+    stats = json.loads(result.stdout)
+    if "first_instruction" in stats:
+        stats["startup"] = stats.pop("first_instruction") - spawned
+    return stats
+
+
+def measure_cli(runs=7):
+    """Median wall time of "python -m iBrainfuck run" on a trivial program.
+
+    This is what a shell user waits for before the first instruction runs:
+    interpreter start, import, argument parsing, parsing and compiling.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-m", "iBrainfuck", "run",
+                                 "-"], input=b"+.", capture_output=True,
+                                cwd=os.path.dirname(PROG_DIR))
+        times.append(time.perf_counter() - start)
+        if result.returncode:
+            return {"error": result.stderr.decode().strip()}
+    wall = sorted(times)[runs // 2]
+    return {"wall": wall, "startup": wall}
+
+
+def run_suite(backends, programs):
+    """Measure all programs on all backends, return results dict."""
+    results = {}
+    for name in programs:
+        # the amount of work, in IR ops
+        work = measure(name, "ir").get("steps")
+        for backend in backends:
+            stats = measure(name, backend)
+            if work and "wall" in stats:
+                stats["ops_per_sec"] = work / stats["wall"]
+            results[f"{name}:{backend}"] = stats
+            print(_report_line(name, backend, stats), flush=True)
+    stats = results["cli:run"] = measure_cli()
+    if "error" in stats:
+        print(f"{'cli':12} {'run':10} error: {stats['error']}")
+    else:
+        print(f"{'cli':12} {'run':10} startup {stats['wall'] * 1000:7.1f} ms")
+    return results
+
+
+def _report_line(name, backend, stats):
+    """Format one result for the terminal."""
+    if "error" in stats:
+        return f"{name:12} {backend:10} error: {stats['error']}"
+    return (f"{name:12} {backend:10} "
+            f"{stats['wall'] * 1000:10.2f} ms "
+            f"{stats.get('ops_per_sec', 0) / 1e6:8.2f} Mops/s "
+            f"{stats['peak_rss_kb'] / 1024:7.1f} MiB "
+            f"startup {stats['startup'] * 1000:7.1f} ms")
+
+
+def find_regressions(results, baseline, threshold):
+    """Return list of messages for runs slower than baseline * (1+thr.)."""
+    regressions = []
+    for key, stats in results.items():
+        old = baseline.get(key)
+        if not old or "wall" not in old or "wall" not in stats:
+            continue
+        for metric in ("wall", "startup"):
+            if stats[metric] > old[metric] * (1 + threshold):
+                regressions.append(f"{key} {metric}: {old[metric]:.4f} s -> "
+                                   f"{stats[metric]:.4f} s")
+    return regressions
+
+
+def main(argv=None):
+    """Command line interface."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-b", "--backends", default="reference,ir,python,c",
+                        help="comma separated backends to measure")
+    parser.add_argument("-p", "--programs", default=",".join(BENCHMARKS),
+                        help="comma separated programs from prog/")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help=f"baseline file (default: {BASELINE})")
+    parser.add_argument("--save", action="store_true",
+                        help="store results as the new baseline")
+    parser.add_argument("--check", action="store_true",
+                        help="exit with 1 if a run regressed")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown for --check (default: 0.2)")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        # worker process, results as JSON on stdout
+        print(json.dumps(run_child(*args.child)))
+        return 0
+
+    results = run_suite(args.backends.split(","), args.programs.split(","))
+    status = 0
+    if args.check and os.path.exists(args.baseline):
+        with open(args.baseline) as basefile:
+            regressions = find_regressions(results, json.load(basefile),
+                                           args.threshold)
+        for message in regressions:
+            print("REGRESSION", message)
+        status = 1 if regressions else 0
+    if args.save:
+        with open(args.baseline, "w") as basefile:
+            json.dump(results, basefile, indent=1, sort_keys=True)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,233 +5,1697 @@ usage:
     (1) create new class instance, feed raw code into it
     (2) run parser
     (3) run program / debug-run program
+or from the shell:
+    python -m iBrainfuck run prog.b < input > output
 
 The parser does some preprocessing which makes code execution safer and
 much faster.
 
 to-do:
-- implement dialects
 - implement GUI
-- cli args
-- single step debugger
-- arbitrary code source
-- arbitrary output sink
 - debugger ASCII-Code view
-- debugger back stepping mode
-- code&data blob format
-- i/o testing, dialect sniffer
-- preprocessor / parser (bracket matching, comment cleanup, stats)
 """
 
+# argparse, asyncio, concurrent.futures, ctypes, curses, hashlib, numpy,
+# shutil, subprocess and tempfile are imported where they are used, so
+# that a short run does not pay for importing them
+import functools
+import io
+import json
+import mmap
 import os
+import re
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from itertools import repeat
+
+# the eight commands, and what the parser looks for in source chunks
+COMMAND_CHARS = "><+-.,[]"
+_command_re = re.compile(r"[][><+.,-]")
+_comment_re = re.compile(r"[^][><+.,-]+")
+_bracket_re = re.compile(r"[][]")
+
+# source is parsed in chunks of this many characters
+PARSE_CHUNK_SIZE = 1 << 20
+
+# bump whenever parser or IR compiler output changes, invalidates blobs
+OPTIMIZER_VERSION = 4
+
+# program blob layout, see bf_program.save_blob()
+BLOB_MAGIC = b"IBFBLOB\0"
+BLOB_VERSION = 1
+_blob_header = struct.Struct("<8sII6Q")
+
+# shared tape file layout, see bf_program.share_tape() and tape_monitor:
+# header (magic, version, cell bits, number of cells, process id of the
+# program), update counter (odd while the state is written), state
+# (running, ip, dp, steps, output bytes), tape from MONITOR_TAPE_OFFSET on
+MONITOR_MAGIC = b"IBFTAPE\0"
+MONITOR_VERSION = 1
+_monitor_header = struct.Struct("<8sIIqq")
+_monitor_seq = struct.Struct("<q")
+_monitor_state = struct.Struct("<5q")
+MONITOR_TAPE_OFFSET = 128
+
+# opcodes of the intermediate representation, see bf_program.compile_ir()
+(OP_ADD, OP_MOVE, OP_SET, OP_MULADD, OP_SCAN,
+ OP_OUT, OP_IN, OP_JZ, OP_JNZ, OP_WRITE) = range(10)
+
+# loops nested deeper than this are moved into helper functions, python
+# refuses to compile more than 20 statically nested blocks
+PY_MAX_NESTING = 16
+
+# IR ops compile_ir() runs at most to fold the start of a program
+FOLD_MAX_STEPS = 100000
+
+# compiled python backend code objects, keyed by hash of the clean code
+_python_cache = {}
+
+# content addressed cache for native shared objects and program blobs
+CACHE_DIR = os.path.join(
+        os.environ.get("XDG_CACHE_HOME",
+                       os.path.join(os.path.expanduser("~"), ".cache")),
+        "ibrainfuck")
+_c_libs = {}
+
+# C cell types per cell width in bits, ctypes and numpy name them without
+# the _t and ctypes with a c_ in front
+C_CELL_TYPES = {
+               8: "uint8_t",
+               16: "uint16_t",
+               32: "uint32_t",
+               64: "uint64_t"
+               }
+
+
+@functools.cache
+def _c_io_func():
+    """Return the ctypes type of the i/o callbacks of compiled programs."""
+    import ctypes
+
+    return ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_long, ctypes.c_long)
+
+
+# cells per page of a paged_tape
+PAGE_SIZE = 4096
+
+# i/o buffer size in bytes
+IO_BLOCK_SIZE = 8192
+
+# steps between two tape checkpoints of the debugger
+CHECKPOINT_INTERVAL = 20000
+
+# execution limits are checked at loop back edges, at most every n steps
+LIMIT_CHECK_INTERVAL = 10000
+
+# steps between two returns to the event loop in bf_program.run_async()
+ASYNC_SLICE_STEPS = 10000
+
+# steps a batch worker spends looking for a program's first input
+PRIME_MAX_STEPS = 1000000
+
+# known brainfuck self-interpreters by clean code hash (sha256, first 32
+# hex digits); they read a program, "!" and then that program's input,
+# see bf_program.run(nested=...)
+SELF_INTERPRETERS = {
+                    "fa50d6a1c300fa2b2fb1fd9f31b14152": "dbfi.b",
+                    }
+
+# steps of the real nested run that run(nested="validate") compares with
+VALIDATE_STEPS = 1000000
+
+
+def make_tape(cell_bits=8, length=30000):
+    """Return a zeroed, compact tape for cells of the given width.
+
+    8 bit cells live in a bytearray, wider cells in an array of the
+    matching item size. Values still have to be masked on write, python
+    containers refuse out of range values instead of wrapping.
+    """
+    if cell_bits == 8:
+        return bytearray(length)
+    for typecode in "HILQ":
+        if array(typecode).itemsize * 8 == cell_bits:
+            return array(typecode, bytes(length * cell_bits // 8))
+    raise ValueError(f"unsupported cell width: {cell_bits} bit")
+
+
+class paged_tape:
+    """Unbounded tape in both directions, allocated page by page.
+
+    A page is only allocated when a nonzero value is written to one of its
+    cells, untouched cells read as zero. fork() shares pages between tapes
+    until they are written.
+    """
+
+    def __init__(self, cell_bits=8, page_size=PAGE_SIZE):
+        """Start with no pages at all."""
+        self.cell_bits = cell_bits
+        self.page_size = page_size
+        self.pages = {}
+
+    def __getitem__(self, index):
+        """Return cell value, or a list of values for a slice."""
+        if isinstance(index, slice):
+            return [self[i] for i in range(index.start or 0, index.stop,
+                                           index.step or 1)]
+        page_no, cell = divmod(index, self.page_size)
+        page = self.pages.get(page_no)
+        return page[cell] if page is not None else 0
+
+    def __setitem__(self, index, value):
+        """Write cell value, allocate its page if needed."""
+        page_no, cell = divmod(index, self.page_size)
+        page = self.pages.get(page_no)
+        if page is None:
+            if not value:
+                return
+            page = self.pages[page_no] = make_tape(self.cell_bits,
+                                                   self.page_size)
+        try:
+            page[cell] = value
+        except TypeError:
+            # frozen page shared with a fork, copy on first write
+            page = self.pages[page_no] = (
+                    bytearray(page) if self.cell_bits == 8
+                    else array(page.format, page.tobytes()))
+            page[cell] = value
+
+    def fork(self):
+        """Return a copy sharing all pages copy-on-write.
+
+        Pages are frozen into read only views, the first write to one
+        in any tape sharing it replaces it with a private copy there.
+        """
+        for page_no, page in self.pages.items():
+            if not isinstance(page, memoryview):
+                self.pages[page_no] = memoryview(bytes(page)).cast(
+                        getattr(page, "typecode", "B"))
+        copy = paged_tape(self.cell_bits, self.page_size)
+        copy.pages = dict(self.pages)
+        return copy
+
+
+class bf_dialect(dict):
+    """Validated dialect settings, see dialects.txt.
+
+    "EOF"           what "," stores at end of input: "unchanged", 0 or -1
+    "linebreak"     "lf", or "crlf" to drop 13 on input and write 13 10
+                    for every 10 on output
+    "len_data"      tape length in cells, ignored by the "extend" policy
+    "cell_bits"     cell width: 8, 16, 32 or 64
+    "cell_wrap"     True: cells wrap around, False: overflow is an error
+    "bounds"        data pointer policy: "ignore", "error", "wrap" or
+                    "extend", see bf_program
+    """
+
+    defaults = {
+               "EOF": 0,
+               "linebreak": "lf",
+               "len_data": 30000,
+               "cell_bits": 8,
+               "cell_wrap": True,
+               "bounds": "ignore"
+               }
+    choices = {
+              "EOF": ("unchanged", 0, -1),
+              "linebreak": ("lf", "crlf"),
+              "cell_bits": (8, 16, 32, 64),
+              "cell_wrap": (True, False),
+              "bounds": ("ignore", "error", "wrap", "extend")
+              }
+
+    def __init__(self, settings=None):
+        """Start from the defaults, override with settings."""
+        super().__init__(self.defaults)
+        self.update(settings or {})
+
+    def update(self, settings=(), **kwargs):
+        """Update like dict, then validate."""
+        super().update(settings, **kwargs)
+        for key, allowed in self.choices.items():
+            if self[key] not in allowed or (isinstance(self[key], bool)
+                                            != (key == "cell_wrap")):
+                raise ValueError(f"invalid dialect {key}: {self[key]!r}")
+        if not isinstance(self["len_data"], int) or self["len_data"] < 1:
+            raise ValueError(f"invalid dialect len_data: "
+                             f"{self['len_data']!r}")
+
+    def signature(self):
+        """Return a hashable key of all settings."""
+        return tuple(sorted((key, str(value)) for key, value in self.items()))
+
+
+# source of the IR engine, specialized per cell wrap and bounds policy by
+# filling in the {slots}, see _ir_loop()
+_IR_LOOP_TEMPLATE = """
+def ir_loop(self, pc, dp, steps, pause, stop, out, inp, put,
+            check_limits):
+    ir = self.ircode
+    data = self.data
+    mask = self.cellmask
+    {setup}
+    next_check = steps + LIMIT_CHECK_INTERVAL
+    if stop is not None:
+        next_check = min(next_check, stop)
+    clock = time.perf_counter()
+    try:
+        while pc < len(ir):
+            op, arg, arg2 = ir[pc]
+            steps += 1
+            if op == OP_ADD:
+                {add}
+            elif op == OP_MOVE:
+                {move}
+            elif op == OP_JZ:
+                if not data[dp]:
+                    pc = arg
+            elif op == OP_JNZ:
+                if data[dp]:
+                    # on behind the JZ, its test would pass
+                    pc = arg + 1
+                    if steps >= next_check:
+                        if pause is not None and steps >= pause:
+                            return pc, dp, steps
+                        check_limits(steps, clock, pc, dp)
+                        next_check = steps + LIMIT_CHECK_INTERVAL
+                        if stop is not None:
+                            next_check = min(next_check, stop)
+                    continue
+            elif op == OP_SET:
+                data[dp + arg2] = arg
+            elif op == OP_MULADD:
+                if data[dp]:
+                    {muladd}
+            elif op == OP_SCAN:
+                while data[dp]:
+                    {scan}
+            elif op == OP_OUT:
+                out(pc, dp)
+            elif op == OP_WRITE:
+                put(arg, dp)
+            elif op == OP_IN:
+                if self.source.starved():
+                    # wait for input, retry this op on resume
+                    return pc, dp, steps - 1
+                inp(pc, dp)
+            pc += 1
+        return pc, dp, steps
+    finally:
+        # an error leaves the state at the failing op, or behind the
+        # back edge that hit a limit, so resume() goes on from there
+        self.steps = steps
+        if self.state is not None:
+            self.state.update(pc=pc, dp=dp, steps=steps)
+            self.state["seconds"] += time.perf_counter() - clock
+"""
+_ir_loops = {}
+
+
+def _ir_loop(cell_wrap, bounds):
+    """Return the IR engine for a cell wrap / bounds policy combination.
+
+    Dialect options are decided here, once per combination, so the
+    generated loop does not check them in any op.
+    """
+    key = (cell_wrap, bounds)
+    if key in _ir_loops:
+        return _ir_loops[key]
+
+    def out_of_range(name):
+        return (f"if not 0 <= {name} < size:\n    raise IndexError("
+                f"f\"data pointer out of range: {{{name}}}\")")
+
+    if bounds == "wrap":
+        move = "dp = (dp + arg) % size"
+        there = "there = (dp + arg) % size"
+    elif bounds == "error":
+        move = "dp += arg\n" + out_of_range("dp")
+        there = "there = dp + arg\n" + out_of_range("there")
+    else:
+        move = "dp += arg"
+        there = "there = dp + arg"
+    if cell_wrap:
+        add = "data[dp] = (data[dp] + arg) & mask"
+        muladd = "data[there] = (data[there] + data[dp] * arg2) & mask"
+    else:
+        # the tape refuses values out of range, that is the error
+        add = "data[dp] += arg"
+        muladd = "data[there] += data[dp] * arg2"
+
+    def slot(code, indent):
+        return code.replace("\n", "\n" + " " * indent)
+
+    source = _IR_LOOP_TEMPLATE.format(
+            setup="size = len(data)" if bounds in ("wrap", "error") else "",
+            add=add,
+            move=slot(move, 16),
+            muladd=slot(there + "\n" + muladd, 20),
+            scan=slot(move, 20))
+    namespace = dict(globals())
+    exec(compile(source, f"<ir loop {cell_wrap} {bounds}>", "exec"),
+         namespace)
+    _ir_loops[key] = namespace["ir_loop"]
+    return _ir_loops[key]
+
+
+def tape_pages(data, previous=None):
+    """Return the tape content as a dict of page number -> bytes.
+
+    Works for flat tapes and paged_tape. Pages equal to the same page in
+    previous are not copied but shared with it, so a series of snapshots
+    only stores what changed in between.
+    """
+    if isinstance(data, paged_tape):
+        pages = {page_no: bytes(page)
+                 for page_no, page in data.pages.items()}
+    else:
+        raw = memoryview(data).cast("B")
+        size = PAGE_SIZE * memoryview(data).itemsize
+        pages = {page_no: raw[start:start + size].tobytes()
+                 for page_no, start in enumerate(range(0, len(raw), size))}
+    if previous:
+        for page_no, page in pages.items():
+            if previous.get(page_no) == page:
+                pages[page_no] = previous[page_no]
+    return pages
+
+
+def restore_tape_pages(data, pages):
+    """Write pages taken by tape_pages() back into the tape data."""
+    if isinstance(data, paged_tape):
+        data.pages = {}
+        for page_no, page in pages.items():
+            data.pages[page_no] = make_tape(data.cell_bits, data.page_size)
+            memoryview(data.pages[page_no]).cast("B")[:] = page
+        return
+    raw = memoryview(data).cast("B")
+    pos = 0
+    for page_no in sorted(pages):
+        raw[pos:pos + len(pages[page_no])] = pages[page_no]
+        pos += len(pages[page_no])
+
+
+def _fold_output(ir, dialect):
+    """Replace output of known cells in straight-line ops by WRITE ops.
+
+    Cell values are followed from SET ops on, relative to the pointer at
+    the start of each run of ops without loops, scans or input. An OUT
+    op of a known cell becomes a WRITE op of that byte, following ones
+    are added to it as long as no op in between may fail: only ops on
+    known cells in range, and moves if the pointer is not checked.
+
+    returns: ops, WRITE ops carry their bytes, and the number of OUT ops
+        replaced; jump targets are not updated
+    """
+    cellmask = (1 << dialect["cell_bits"]) - 1
+    wrapmask = cellmask if dialect["cell_wrap"] else -1
+    bounds = dialect["bounds"]
+    size = dialect["len_data"]
+    crlf = dialect["linebreak"] == "crlf"
+    # the tape does not refuse any position
+    unchecked = bounds in ("wrap", "extend")
+    ops = []
+    known = {}
+    rel = 0
+    chunk = None
+    replaced = 0
+    for op, arg, arg2 in ir:
+        if op in (OP_JZ, OP_JNZ, OP_SCAN, OP_IN):
+            known.clear()
+            rel = 0
+            chunk = None
+            ops.append((op, arg, arg2))
+            continue
+        here = rel % size if bounds == "wrap" else rel
+        value = known.get(here)
+        safe = True
+        if op == OP_OUT:
+            if value is not None and not (crlf and value != 10
+                                          and value & 255 == 10):
+                if chunk is None:
+                    chunk = bytearray()
+                    ops.append((OP_WRITE, chunk, 0))
+                chunk.append(value & 255)
+                replaced += 1
+                continue
+            safe = False
+        elif op == OP_WRITE:
+            safe = False
+        elif op == OP_MOVE:
+            rel += arg
+            safe = bounds != "error"
+        elif op == OP_SET:
+            there = (rel + arg2) % size if bounds == "wrap" else rel + arg2
+            safe = unchecked or there in known
+            known[there] = arg
+        elif op == OP_ADD or op == OP_MULADD and value != 0:
+            there = here
+            if op == OP_MULADD:
+                there = (rel + arg) % size if bounds == "wrap" else rel + arg
+            old = known.pop(there, None)
+            if value is None or old is None:
+                safe = unchecked and dialect["cell_wrap"]
+            else:
+                new = (old + (value * arg2 if op == OP_MULADD else arg)
+                       ) & wrapmask
+                safe = 0 <= new <= cellmask
+                if safe:
+                    known[there] = new
+        if not safe:
+            chunk = None
+        ops.append((op, arg, arg2))
+    return [(op, bytes(arg), arg2) if op == OP_WRITE else (op, arg, arg2)
+            for op, arg, arg2 in ops], replaced
+
+
+class bf_limit_error(RuntimeError):
+    """A program exceeded one of its execution limits."""
+
+
+class bf_nested_error(RuntimeError):
+    """A guest program run directly disagrees with its interpreted run."""
+
+
+class byte_source:
+    """Buffered input bytes.
+
+    origin may be a binary (or text) file, bytes, a str or any iterable of
+    ints, bytes or str chunks, e.g. a generator. Files are read block by
+    block, with read1() where available, so interactive input is handed
+    over as soon as it arrives.
+    origin None makes a push source: input arrives through feed() until
+    close() is called, in between the source may be starved().
+    """
+
+    def __init__(self, origin, block_size=IO_BLOCK_SIZE):
+        """Wrap origin, nothing is read yet."""
+        self.block_size = block_size
+        self.buffer = b""
+        self.pos = 0
+        self.closed = origin is not None
+        if isinstance(origin, str):
+            origin = origin.encode("latin-1")
+        if origin is None:
+            self.reader = None
+        elif isinstance(origin, (bytes, bytearray, memoryview)):
+            self.buffer = bytes(origin)
+            self.reader = None
+        elif hasattr(origin, "read1"):
+            self.reader = origin.read1
+        elif hasattr(origin, "read"):
+            self.reader = origin.read
+        else:
+            chunks = iter(origin)
+            self.reader = lambda size: next(chunks, b"")
+
+    def pending(self):
+        """Return number of bytes that can be read without blocking."""
+        return len(self.buffer) - self.pos
+
+    def starved(self):
+        """Return True if a push source has no data but is still open."""
+        return not self.closed and self.pos >= len(self.buffer)
+
+    def feed(self, chunk):
+        """Append bytes to a push source."""
+        self.buffer = self.buffer[self.pos:] + bytes(chunk)
+        self.pos = 0
+
+    def close(self):
+        """Mark the end of a push source, EOF after its remaining bytes."""
+        self.closed = True
+
+    def unread(self, chunk):
+        """Put bytes back, they are read again before anything else."""
+        self.buffer = bytes(chunk) + self.buffer[self.pos:]
+        self.pos = 0
+
+    def read_byte(self):
+        """Return next input byte, None at EOF."""
+        if self.pos >= len(self.buffer) and not self.__refill():
+            return None
+        self.pos += 1
+        return self.buffer[self.pos - 1]
+
+    def __refill(self):
+        """Read the next block, return False at EOF."""
+        if self.reader is None:
+            return False
+        chunk = self.reader(self.block_size)
+        if isinstance(chunk, int):
+            chunk = bytes((chunk & 255,))
+        elif isinstance(chunk, str):
+            chunk = chunk.encode("latin-1")
+        if not chunk:
+            self.reader = None
+            return False
+        self.buffer = chunk
+        self.pos = 0
+        return True
+
+
+class byte_sink:
+    """Buffered output bytes.
+
+    target may be a binary or text file or a callable taking bytes.
+    flush selects when the buffer is handed over:
+        "always"    after every byte
+        "line"      after every newline (10) and when full
+        "block"     only when full, on flush() and at program end
+        "auto"      "line" for terminals, "block" otherwise
+    """
+
+    def __init__(self, target, flush="auto", block_size=IO_BLOCK_SIZE):
+        """Wrap target with an empty buffer."""
+        if hasattr(target, "write"):
+            if isinstance(target, io.TextIOBase):
+                self.writer = lambda chunk: target.write(
+                        chunk.decode("latin-1"))
+            else:
+                self.writer = target.write
+            self.target_flush = getattr(target, "flush", None)
+        else:
+            self.writer = target
+            self.target_flush = None
+        if flush == "auto":
+            isatty = getattr(target, "isatty", None)
+            flush = "line" if isatty and isatty() else "block"
+        self.flush_on = 10 if flush == "line" else None
+        self.limit = 1 if flush == "always" else block_size
+        self.buffer = bytearray()
+        self.count = 0
+
+    def write_byte(self, value):
+        """Append one byte, flush according to policy."""
+        self.count += 1
+        self.buffer.append(value)
+        if value == self.flush_on or len(self.buffer) >= self.limit:
+            self.flush()
+
+    def write(self, chunk):
+        """Append bytes, flush according to policy."""
+        self.count += len(chunk)
+        self.buffer += chunk
+        if (self.flush_on is not None and self.flush_on in chunk
+                or len(self.buffer) >= self.limit):
+            self.flush()
+
+    def flush(self):
+        """Hand buffered bytes over to the target."""
+        if self.buffer:
+            self.writer(bytes(self.buffer))
+            self.buffer.clear()
+        if self.target_flush:
+            self.target_flush()
+
+
+class tape_monitor:
+    """Live view of a program's shared tape from any process.
+
+    Opens the file of bf_program.share_tape() read-only and reads tape
+    and state while the program runs, without stopping or slowing it.
+    """
+
+    def __init__(self, path):
+        """Map the shared tape file at path."""
+        with open(path, "rb") as tapefile:
+            self.map = mmap.mmap(tapefile.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        magic, version, self.cell_bits, self.length, self.pid = (
+                _monitor_header.unpack_from(self.map))
+        if (magic, version) != (MONITOR_MAGIC, MONITOR_VERSION):
+            self.map.close()
+            raise ValueError(f"not a shared tape: {path}")
+        self.cells = memoryview(self.map)[MONITOR_TAPE_OFFSET:].cast(
+                getattr(make_tape(self.cell_bits, 0), "typecode", "B"))
+
+    def state(self):
+        """Return a consistent dict of running, ip, dp, steps, output.
+
+        ip is the IR op of the last update, -1 if the program did not
+        run on the IR engine; steps is -1 if not counted.
+        """
+        while True:
+            seq, = _monitor_seq.unpack_from(self.map, _monitor_header.size)
+            values = _monitor_state.unpack_from(
+                    self.map, _monitor_header.size + _monitor_seq.size)
+            if not seq % 2 and seq == _monitor_seq.unpack_from(
+                    self.map, _monitor_header.size)[0]:
+                break
+            # the program is writing right now
+            time.sleep(0)
+        return dict(zip(("running", "ip", "dp", "steps", "output"), values))
+
+    def alive(self):
+        """Return False if the program's process is gone."""
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def tape_view(self, start, stop):
+        """Return a copy of cells start..stop-1 as a list."""
+        return self.cells[max(start, 0):stop].tolist()
+
+    def close(self):
+        """Unmap the file."""
+        self.cells.release()
+        self.map.close()
 
 
 class bf_program:
     """Run a brainfuck program and serve input / output."""
 
-    def __init__(self, prog="", debugmode=False):
-        """Initialize runtime environment."""
+    def __init__(self, prog="", debugmode=False, dialect=None,
+                 source=None, sink=None, limits=None):
+        """Initialize runtime environment.
+
+        dialect: dict overriding entries of the default self.dialect, see
+            bf_dialect
+        source: byte_source or anything it accepts, default stdin
+        sink: byte_sink or anything it accepts, default stdout
+        limits: dict overriding entries of the default self.limits, all
+            unlimited (None):
+            "steps"     executed IR ops, commands on the backends that
+                        interpret the clean code
+            "seconds"   time spent executing, pauses do not count
+            "output"    output bytes
+            "cells"     allocated tape cells
+
+        dialect["bounds"] selects what happens if the data pointer leaves
+        the tape:
+            "ignore"    no checks, negative positions index from the end
+            "error"     raise IndexError
+            "wrap"      wrap around to the other end of the tape
+            "extend"    unbounded paged_tape, len_data is ignored
+        """
         # Hello World!
         testprog = ("++++++++++ [ >+++++++>++++++++++>+++>+<<<<- ] >++."
                     ">+. +++++++. . +++. >++. <<+++++++++++++++. >. +++."
                     " ------. --------. >+. >. +++. ")
         self.codestr = testprog if prog == "" else prog
-        self.cleancode = []
-        self.brackets = []
+        self.cleancode = ""
+        # True once parse_code() or load_blob() filled in the clean code,
+        # which is empty for a program without commands
+        self.parsed = False
+        self.brackets = array("l")
+        self.jumps = array("l")
+        self.codepos = array("l")
+        self.ircode = []
+        # bytes output by the WRITE ops of the IR, see compile_ir()
+        self.irconst = []
         self.cstats = {}
-        self.data = [0] * 30000
-        self.output_cache = []
+        # executed commands / IR ops of the last run, None if not counted
+        self.steps = None
+        self.limits = {
+                      "steps": None,
+                      "seconds": None,
+                      "output": None,
+                      "cells": None
+                      }
+        self.limits.update(limits or {})
+        # resumable IR execution state, see resume()
+        self.state = None
+        # raw counters of the last profiled run, see run(profile=True)
+        self.profile = None
+        # clean code positions and cell -> condition to trap at, and the
+        # function called with a trap event, see set_breakpoint()
+        self.breakpoints = set()
+        self.watchpoints = {}
+        self.on_trap = None
+        if source is None:
+            source = getattr(sys.stdin, "buffer", sys.stdin)
+        if sink is None:
+            sink = getattr(sys.stdout, "buffer", sys.stdout)
+        self.source = (source if isinstance(source, byte_source)
+                       else byte_source(source))
+        self.sink = sink if isinstance(sink, byte_sink) else byte_sink(sink)
         self.isdebug = debugmode
-        self.commands = {
-                        ">": {
-                             "name": "inc_dpointer",
-                             "method": self.__inc_dpointer,
-                             "help": (
-                                     "Increment the data pointer (to point "
-                                     "to the next cell to the right)."
-                                     )
-                             },
-                        "<": {
-                             "name": "dec_dpointer",
-                             "method": self.__dec_dpointer,
-                             "help": (
-                                     "Decrement the data pointer (to point"
-                                     "to the next cell to the left)."
-                                     )
-                             },
-                        "+": {
-                             "name": "inc_dbyte",
-                             "method": self.__inc_dbyte,
-                             "help": (
-                                     "Increment (increase by one) the "
-                                     "byte at the data pointer."
-                                     )
-                             },
-                        "-": {
-                             "name": "dec_dbyte",
-                             "method": self.__dec_dbyte,
-                             "help": (
-                                     "Decrement (decrease by one) the "
-                                     "byte at the data pointer."
-                                     )
-                             },
-                        ".": {
-                             "name": "out_dbyte",
-                             "method": self.__out_dbyte,
-                             "help": "Output the byte at data pointer."
-                             },
-                        ",": {
-                             "name": "in_dbyte",
-                             "method": self.__in_dbyte,
-                             "help": (
-                                     "Accept one byte of input, storing "
-                                     "its value in the byte at the "
-                                     "data pointer."
-                                     )
-                             },
-                        "[": {
-                             "name": "jzf_block",
-                             "method": self.__jzf_block,
-                             "help": (
-                                     "If the byte at the data pointer is "
-                                     "zero, then instead of moving the "
-                                     "instruction pointer forward to the "
-                                     "next command, jump it forward to the "
-                                     "command after matching ] command."
-                                     )
-                             },
-                        "]": {
-                             "name": "jzb_block",
-                             "method": self.__jzb_block,
-                             "help": (
-                                     "If the byte at the data pointer is "
-                                     "nonzero, then instead of moving the "
-                                     "instruction pointer forward to the "
-                                     "next command, jump it back to the "
-                                     "command after the matching "
-                                     "[ command."
-                                     )
-                             }
-                        }
-        self.dialect = {
-                       "EOF": " ",
-                       "linebreak": " ",
-                       "len_data": 30000
-                       }
-
-    def parse_code(self):
+        self.dialect = bf_dialect()
+        self.set_dialect(dialect)
+
+    @functools.cached_property
+    def commands(self):
+        """Name, method and help text per command, built on first use."""
+        return {
+               ">": {
+                    "name": "inc_dpointer",
+                    "method": self.__inc_dpointer,
+                    "help": (
+                            "Increment the data pointer (to point "
+                            "to the next cell to the right)."
+                            )
+                    },
+               "<": {
+                    "name": "dec_dpointer",
+                    "method": self.__dec_dpointer,
+                    "help": (
+                            "Decrement the data pointer (to point"
+                            "to the next cell to the left)."
+                            )
+                    },
+               "+": {
+                    "name": "inc_dbyte",
+                    "method": self.__inc_dbyte,
+                    "help": (
+                            "Increment (increase by one) the "
+                            "byte at the data pointer."
+                            )
+                    },
+               "-": {
+                    "name": "dec_dbyte",
+                    "method": self.__dec_dbyte,
+                    "help": (
+                            "Decrement (decrease by one) the "
+                            "byte at the data pointer."
+                            )
+                    },
+               ".": {
+                    "name": "out_dbyte",
+                    "method": self.__out_dbyte,
+                    "help": "Output the byte at data pointer."
+                    },
+               ",": {
+                    "name": "in_dbyte",
+                    "method": self.__in_dbyte,
+                    "help": (
+                            "Accept one byte of input, storing "
+                            "its value in the byte at the "
+                            "data pointer."
+                            )
+                    },
+               "[": {
+                    "name": "jzf_block",
+                    "method": self.__jzf_block,
+                    "help": (
+                            "If the byte at the data pointer is "
+                            "zero, then instead of moving the "
+                            "instruction pointer forward to the "
+                            "next command, jump it forward to the "
+                            "command after matching ] command."
+                            )
+                    },
+               "]": {
+                    "name": "jzb_block",
+                    "method": self.__jzb_block,
+                    "help": (
+                            "If the byte at the data pointer is "
+                            "nonzero, then instead of moving the "
+                            "instruction pointer forward to the "
+                            "next command, jump it back to the "
+                            "command after the matching "
+                            "[ command."
+                            )
+                    }
+               }
+
+    def set_dialect(self, dialect=None):
+        """Update self.dialect with dialect and start over with a new tape."""
+        self.dialect.update(dialect or {})
+        self.cellmask = (1 << self.dialect["cell_bits"]) - 1
+        # arithmetic mask, & -1 keeps any value for the tape to reject
+        self.wrapmask = self.cellmask if self.dialect["cell_wrap"] else -1
+        eof = self.dialect["EOF"]
+        self.eof_value = None if eof == "unchanged" else eof & self.cellmask
+        self.crlf = self.dialect["linebreak"] == "crlf"
+        # the IR is folded for the tape and cells, see compile_ir()
+        self.ircode = []
+        self.irconst = []
+        # memory map of a shared tape, see share_tape()
+        self.tape_map = None
+        if self.dialect["bounds"] == "extend":
+            self.data = paged_tape(self.dialect["cell_bits"])
+        else:
+            self.data = make_tape(self.dialect["cell_bits"],
+                                  self.dialect["len_data"])
+        # data pointer check, None if the policy needs none
+        self.dp_bound = {
+                        "ignore": None,
+                        "extend": None,
+                        "error": self.__check_dpointer,
+                        "wrap": self.__wrap_dpointer
+                        }[self.dialect["bounds"]]
+
+    def parse_code(self, source=None):
         """Parse code, check for problems and do a light static analysis.
 
+        source: file object, mmap or iterable of str / bytes chunks to parse
+            instead of self.codestr, bytes count as latin-1
+
         returns: clean code, bracket lookup table, code statistics dict
+
+        Single pass over the source, chunk by chunk. The clean code is a
+        str of commands only, brackets an array of their positions in it.
+        Also builds self.jumps, which maps the position of every bracket in
+        the clean code to the position of its partner, and self.codepos,
+        which maps clean code positions to offsets in the source.
+        Unmatched brackets raise ValueError with their source offset.
         """
         # prepare data structures
-        self.cleancode.clear()
-        self.brackets.clear()
-        self.cstats.clear()
+        self.brackets = array("l")
+        self.codepos = array("l")
         self.cstats = {
-                      "num_char": {
-                                  ">": 0,
-                                  "<": 0,
-                                  "+": 0,
-                                  "-": 0,
-                                  ".": 0,
-                                  ",": 0,
-                                  "[": 0,
-                                  "]": 0,
-                                  "comment": 0,
-                                  "code": 0
-                                  },
+                      "num_char": dict.fromkeys(COMMAND_CHARS, 0),
                       "max_bracket_depth": 0
                       }
+        self.cstats["num_char"].update({"comment": 0, "code": 0})
+        num_char = self.cstats["num_char"]
+        if source is None:
+            source = [self.codestr]
+        elif hasattr(source, "read"):
+            reader = source
+            source = iter(lambda: reader.read(PARSE_CHUNK_SIZE),
+                          reader.read(0))
 
-        # analyze code
-        bracket_level = 0
-        for char in self.codestr:
-            if char in self.commands.keys():
-                self.cstats["num_char"][char] += 1
-                self.cstats["num_char"]["code"] += 1
-                self.cleancode.append(char)
-
-                # bracket matching
-                if char == "[":
-                    bracket_level += 1
-                    self.brackets.append({
-                                         "dir": 1,
-                                         "pos": len(self.cleancode) - 1,
-                                         "match": 0
-                                         })
-                    self.cstats["max_bracket_depth"] = max(
-                            bracket_level,
-                            self.cstats["max_bracket_depth"]
-                            )
+        # analyze code, chunk by chunk
+        parts = []
+        num_code = 0
+        num_source = 0
+        open_brackets = []
+        pairs = array("l")
+        for chunk in source:
+            if not isinstance(chunk, str):
+                chunk = bytes(chunk).decode("latin-1")
+            clean = _comment_re.sub("", chunk)
+            self.codepos.extend(match.start() + num_source
+                                for match in _command_re.finditer(chunk))
 
-                elif char == "]":
-                    bracket_level -= 1
-                    self.brackets.append({
-                                         "dir": -1,
-                                         "pos": len(self.cleancode) - 1,
-                                         "match": 0
-                                         })
-                # if we have an unmatched bracket we're off
-                if bracket_level < 0:
-                    raise ValueError()
-                    return self.cleancode, self.brackets, self.cstats
+            # bracket matching with a stack
+            for match in _bracket_re.finditer(clean):
+                pos = match.start() + num_code
+                self.brackets.append(pos)
+                if match.group() == "[":
+                    open_brackets.append(pos)
+                    if len(open_brackets) > self.cstats["max_bracket_depth"]:
+                        self.cstats["max_bracket_depth"] = len(open_brackets)
+                elif open_brackets:
+                    pairs.append(open_brackets.pop())
+                    pairs.append(pos)
+                else:
+                    # if we have an unmatched bracket we're off
+                    raise ValueError("unmatched ] at offset "
+                                     f"{self.codepos[pos]}")
 
-            else:
-                self.cstats["num_char"]["comment"] += 1
+            for char in COMMAND_CHARS:
+                num_char[char] += clean.count(char)
+            num_char["comment"] += len(chunk) - len(clean)
+            parts.append(clean)
+            num_code += len(clean)
+            num_source += len(chunk)
 
         # any unmatched brackets?
-        if bracket_level:
-            raise ValueError()
-            return self.cleancode, self.brackets, self.cstats
-        else:
-            # safe to complete lookup table
-            for i, bracket in enumerate(self.brackets):
-                if (bracket["dir"] + 1):
-                    local_bracket_level = 0
-                    for candidate in self.brackets[i:]:
-                        local_bracket_level += candidate["dir"]
-                        if not local_bracket_level:
-                            # we found the matching candidate
-                            self.brackets[i]["match"] = candidate["pos"]
-                            candidate["match"] = self.brackets[i]["pos"]
-                            break
+        if open_brackets:
+            raise ValueError("unmatched [ at offset "
+                             f"{self.codepos[open_brackets[-1]]}")
+        num_char["code"] = num_code
+        self.cleancode = "".join(parts)
+        self.parsed = True
+
+        # dense jump table, indexed by position in clean code
+        self.jumps = array("l", [0]) * num_code
+        for i in range(0, len(pairs), 2):
+            self.jumps[pairs[i]] = pairs[i + 1]
+            self.jumps[pairs[i + 1]] = pairs[i]
 
         return self.cleancode, self.brackets, self.cstats
 
+    def parse_file(self, path):
+        """Parse a source file through mmap, without reading it at once.
+
+        self.codestr is left alone, so offsets refer to the file.
+        """
+        with open(path, "rb") as srcfile:
+            if not os.fstat(srcfile.fileno()).st_size:
+                return self.parse_code([])
+            with mmap.mmap(srcfile.fileno(), 0,
+                           access=mmap.ACCESS_READ) as srcmap:
+                return self.parse_code(
+                        srcmap[start:start + PARSE_CHUNK_SIZE]
+                        for start in range(0, len(srcmap), PARSE_CHUNK_SIZE))
+
+    def save_blob(self, path, tape=False):
+        """Write the parsed and optimized program to a binary blob file.
+
+        The blob holds clean code, bracket and jump tables, source offsets,
+        IR, code statistics, dialect and, with tape=True, the current tape.
+        load_blob() maps it back without parsing or optimizing.
+
+        layout (little endian, sections padded to 8 bytes):
+            header: magic, blob version, optimizer version, byte length of
+                meta JSON, clean code and tape, number of brackets, clean
+                code positions and IR ops
+            meta JSON (dialect, cstats, tape typecode, WRITE op bytes as
+            latin-1 strings), clean code (ASCII), brackets, jumps,
+            codepos, IR ops (int64 triples), tape
+        """
+        if not self.ircode:
+            self.compile_ir()
+        if tape and isinstance(self.data, paged_tape):
+            raise ValueError("cannot store a paged tape in a blob")
+        program = self
+        if tape and self.__folded_start():
+            # the stored IR has to start on the stored tape, compiled
+            # aside, a paused run goes on with its own IR
+            program = self.spawn()
+            program.cstats = dict(self.cstats)
+            program.data = self.data
+            program.compile_ir()
+        tape_bytes = bytes(self.data) if tape else b""
+        if tape and isinstance(self.data, array):
+            tape_bytes = self.data.tobytes()
+        meta = json.dumps({
+                          "dialect": self.dialect,
+                          "cstats": program.cstats,
+                          "typecode": getattr(self.data, "typecode",
+                                              getattr(self.data, "format",
+                                                      "B")),
+                          "irconst": [chunk.decode("latin-1")
+                                      for chunk in program.irconst]
+                          }).encode()
+        code = self.cleancode.encode("ascii")
+        sections = [meta, code,
+                    array("q", self.brackets).tobytes(),
+                    array("q", self.jumps).tobytes(),
+                    array("q", self.codepos).tobytes(),
+                    array("q", [value for op in program.ircode
+                                for value in op]).tobytes(),
+                    tape_bytes]
+        header = _blob_header.pack(BLOB_MAGIC, BLOB_VERSION,
+                                   OPTIMIZER_VERSION, len(meta), len(code),
+                                   len(tape_bytes), len(self.brackets),
+                                   len(self.cleancode),
+                                   len(program.ircode))
+        # write atomically, blobs may be shared between processes
+        tmppath = f"{path}.{os.getpid()}.tmp"
+        with open(tmppath, "wb") as blobfile:
+            blobfile.write(header)
+            for section in sections:
+                blobfile.write(section)
+                blobfile.write(bytes(-len(section) % 8))
+        os.replace(tmppath, path)
+
+    def load_blob(self, path):
+        """Load a program written by save_blob(), replaces parsed code.
+
+        Raises ValueError if the blob is of another format or optimizer
+        version.
+        """
+        with open(path, "rb") as blobfile, \
+                mmap.mmap(blobfile.fileno(), 0,
+                          access=mmap.ACCESS_READ) as blobmap:
+            (magic, version, optimizer, len_meta, len_code, len_tape,
+             num_brackets, num_code, num_ops) = _blob_header.unpack_from(
+                    blobmap)
+            if (magic, version, optimizer) != (BLOB_MAGIC, BLOB_VERSION,
+                                               OPTIMIZER_VERSION):
+                raise ValueError(f"incompatible program blob: {path}")
+            view = memoryview(blobmap)
+            sections = []
+            pos = _blob_header.size
+            for size in (len_meta, len_code, 8 * num_brackets, 8 * num_code,
+                         8 * num_code, 24 * num_ops, len_tape):
+                sections.append(view[pos:pos + size])
+                pos += size + (-size % 8)
+
+            meta = json.loads(bytes(sections[0]))
+            self.set_dialect(meta["dialect"])
+            self.cstats = meta["cstats"]
+            self.cleancode = str(sections[1], "ascii")
+            self.parsed = True
+            self.brackets = self.__blob_array(sections[2])
+            self.jumps = self.__blob_array(sections[3])
+            self.codepos = self.__blob_array(sections[4])
+            values = iter(sections[5].cast("q"))
+            self.ircode = list(zip(values, values, values))
+            self.irconst = [chunk.encode("latin-1")
+                            for chunk in meta["irconst"]]
+            if len_tape:
+                if isinstance(self.data, bytearray):
+                    self.data[:] = sections[6]
+                else:
+                    self.data = array(meta["typecode"])
+                    self.data.frombytes(sections[6])
+            del view, sections
+        if self.__folded_start():
+            # a blob without tape loaded onto a used one
+            self.compile_ir()
+        return self
+
+    def __blob_array(self, section):
+        """Return an array("l") from a blob section of int64 values."""
+        if array("l").itemsize == 8:
+            table = array("l")
+            table.frombytes(section)
+            return table
+        return array("l", section.cast("q"))
+
+    def compile_ir(self):
+        """Translate clean code into an optimized intermediate representation.
+
+        Runs of +/- and >/< are folded into single ADD / MOVE ops and some
+        common loop idioms are replaced:
+            [-], [+]            -> SET(0)
+            [->+>++<<] etc.     -> MULADD(offset, factor) ..., SET(0)
+            [>], [<<] etc.      -> SCAN(step)
+        A checked dialect (bounds "error", no cell wrap) must fail where
+        the commands fail, so there only runs of one command are folded,
+        not <<>> or -+, and loops leaving the range their ops check are
+        kept.
+        Every op is a tuple (opcode, arg, arg2). JZ / JNZ carry the index
+        of their partner op, JZ has arg2 = 1 if its loop is balanced. SET
+        writes arg to the cell at offset arg2, always 0 except for SET ops
+        from folding, whose offsets are known to be on the tape. WRITE
+        outputs the bytes self.irconst[arg], output computed here.
+
+        Then the ops are analyzed, see __fold_prefix(), _fold_output() and
+        __mark_balanced(), and the results are added to
+        self.cstats["analysis"]:
+            "ir_ops"            number of ops
+            "folded_ops"        ops of the start replaced by SET ops and
+                                a WRITE op of their output
+            "folded_steps"      steps the program no longer executes
+            "dead_loops"        loops in the replaced ops never entered,
+                                like a leading comment loop
+            "output_ops"        OUT ops replaced by WRITE ops, including
+                                the ones of the start
+            "write_ops"         WRITE ops
+            "loops"             loops left
+            "balanced_loops"    loops among them not moving the pointer
+
+        returns: list of ops
+        """
+        if not self.parsed:
+            self.parse_code()
+        code = self.cleancode
+        strict = (("><" if self.dialect["bounds"] == "error" else "")
+                  + ("" if self.dialect["cell_wrap"] else "+-"))
+        ir = []
+        open_loops = []
+        i = 0
+        while i < len(code):
+            char = code[i]
+            if char in "+-" or char in "<>":
+                # fold a run of the same command class, of the same
+                # command if the dialect checks that class
+                kind = "+-" if char in "+-" else "><"
+                count = 0
+                while i < len(code) and code[i] in kind and (
+                        code[i] == char or kind not in strict):
+                    count += 1 if code[i] == kind[0] else -1
+                    i += 1
+                if count:
+                    ir.append((OP_ADD if kind == "+-" else OP_MOVE, count, 0))
+                continue
+            elif char == ".":
+                ir.append((OP_OUT, 0, 0))
+            elif char == ",":
+                ir.append((OP_IN, 0, 0))
+            elif char == "[":
+                idiom = self.__match_idiom(i)
+                if idiom is not None:
+                    ir.extend(idiom)
+                    i = self.jumps[i] + 1
+                    continue
+                open_loops.append(len(ir))
+                ir.append((OP_JZ, 0, 0))
+            elif char == "]":
+                start = open_loops.pop()
+                ir[start] = (OP_JZ, len(ir), 0)
+                ir.append((OP_JNZ, start, 0))
+            i += 1
+
+        ir, folded = self.__fold_prefix(ir)
+        ir, replaced = _fold_output(ir, self.dialect)
+        # link the jumps again, WRITE ops get their bytes from irconst
+        self.irconst = []
+        open_loops = []
+        for pc, (op, arg, arg2) in enumerate(ir):
+            if op == OP_WRITE:
+                ir[pc] = (OP_WRITE, len(self.irconst), 0)
+                self.irconst.append(arg)
+            elif op == OP_JZ:
+                open_loops.append(pc)
+            elif op == OP_JNZ:
+                start = open_loops.pop()
+                ir[start] = (OP_JZ, pc, 0)
+                ir[pc] = (OP_JNZ, start, 0)
+        balanced = self.__mark_balanced(ir)
+        self.cstats["analysis"] = {
+                                  "ir_ops": len(ir),
+                                  "folded_ops": folded["ops"],
+                                  "folded_steps": folded["steps"],
+                                  "dead_loops": folded["dead_loops"],
+                                  "output_ops": folded["output"] + replaced,
+                                  "write_ops": len(self.irconst),
+                                  "loops": sum(op == OP_JZ
+                                               for op, arg, arg2 in ir),
+                                  "balanced_loops": balanced
+                                  }
+        self.ircode = ir
+        return self.ircode
+
+    def __fold_prefix(self, ir):
+        """Replace the input independent start of ir by SET and WRITE ops.
+
+        All cells are zero at program start, so the ops up to the first
+        input, up to a pointer or value the dialect refuses, or for at most
+        FOLD_MAX_STEPS steps can be executed right here. The ops up to the
+        last point outside of all loops are replaced by SET ops for the
+        resulting cells, one MOVE and one WRITE op of their output, if that
+        is less work than running them. Nothing is folded if the tape is
+        not zero, such IR is compiled again once it is, see
+        __folded_start().
+
+        returns: ops, WRITE ops carry their bytes, dict of "ops" replaced,
+            "steps" saved, "dead_loops", "output" ops replaced
+        """
+        if not self.__zero_tape():
+            return ir, {"ops": 0, "steps": 0, "dead_loops": 0, "output": 0}
+        depth = []
+        level = 0
+        for op, arg, arg2 in ir:
+            level += op == OP_JZ
+            level -= op == OP_JNZ
+            depth.append(level + (op == OP_JNZ))
+        depth.append(0)
+        extend = self.dialect["bounds"] == "extend"
+        size = self.dialect["len_data"]
+        tape = {}
+        output = bytearray()
+        dp = pc = steps = 0
+        saved = (pc, {}, dp, steps, 0)
+        skipped = set()
+        entered = set()
+        while pc < len(ir) and steps < FOLD_MAX_STEPS:
+            op, arg, arg2 = ir[pc]
+            if op == OP_JZ and not depth[pc] - 1:
+                # entering a top level loop, the last point to fall back to
+                saved = (pc, dict(tape), dp, steps, len(output))
+            value = tape.get(dp, 0)
+            if op == OP_ADD or op == OP_MULADD and value:
+                there = dp + arg if op == OP_MULADD else dp
+                old = tape.get(there, 0)
+                new = (old + (value * arg2 if op == OP_MULADD else arg)
+                       ) & self.wrapmask
+                if not (extend or 0 <= there < size) or not (
+                        0 <= new <= self.cellmask):
+                    break
+                tape[there] = new
+            elif op == OP_MOVE:
+                if not (extend or 0 <= dp + arg < size):
+                    break
+                dp += arg
+            elif op == OP_SCAN:
+                there = dp
+                while tape.get(there, 0) and (extend
+                                              or 0 <= there + arg < size):
+                    there += arg
+                if tape.get(there, 0):
+                    # the scan leaves the tape
+                    break
+                dp = there
+            elif op == OP_SET:
+                tape[dp] = arg
+            elif op == OP_JZ:
+                (entered if value else skipped).add(pc)
+                if not value:
+                    pc = arg
+            elif op == OP_JNZ:
+                if value:
+                    pc = arg
+            elif op == OP_OUT:
+                if self.crlf and value != 10 and value & 255 == 10:
+                    # written as 10 without 13, no WRITE op does that
+                    break
+                output.append(value & 255)
+            elif op == OP_IN:
+                break
+            pc += 1
+            steps += 1
+        if depth[pc]:
+            pc, tape, dp, steps, written = saved
+            del output[written:]
+
+        # the start is at dp 0, so cell numbers are offsets
+        folded = [(OP_SET, tape[cell], cell) for cell in sorted(tape)
+                  if tape[cell]]
+        if dp:
+            folded.append((OP_MOVE, dp, 0))
+        if output:
+            folded.append((OP_WRITE, bytes(output), 0))
+        if steps <= len(folded):
+            return ir, {"ops": 0, "steps": 0, "dead_loops": 0, "output": 0}
+        stats = {
+                "ops": pc,
+                "steps": steps - len(folded),
+                "dead_loops": sum(start < pc for start in skipped - entered),
+                "output": len(output)
+                }
+        shift = len(folded) - pc
+        folded += [(op, arg + shift, arg2) if op in (OP_JZ, OP_JNZ)
+                   else (op, arg, arg2) for op, arg, arg2 in ir[pc:]]
+        return folded, stats
+
+    def __zero_tape(self):
+        """Return True if all cells are zero, as at program start."""
+        if isinstance(self.data, paged_tape):
+            return not any(any(page) for page in self.data.pages.values())
+        raw = memoryview(self.data).cast("B")
+        return raw.tobytes().count(0) == len(raw)
+
+    def __folded_start(self):
+        """Return True if the IR starts folded but the tape is not zero.
+
+        The folded start sets cells, it does not add to them, and skips
+        loops, so it only runs right on a zero tape.
+        """
+        return bool(self.ircode and self.cstats["analysis"]["folded_ops"]
+                    and not self.__zero_tape())
+
+    def __mark_balanced(self, ir):
+        """Set arg2 = 1 in the JZ op of every balanced loop in ir.
+
+        A loop is balanced if its body leaves the pointer where it was:
+        its moves add up to zero and all loops in it are balanced. Code
+        generators can address its cells by fixed offsets.
+
+        returns: number of balanced loops
+        """
+        moves = [[0, True]]
+        count = 0
+        for pc, (op, arg, arg2) in enumerate(ir):
+            if op == OP_MOVE:
+                moves[-1][0] += arg
+            elif op == OP_SCAN:
+                moves[-1][1] = False
+            elif op == OP_JZ:
+                moves.append([0, True])
+            elif op == OP_JNZ:
+                move, balanced = moves.pop()
+                if balanced and not move:
+                    ir[arg] = (OP_JZ, pc, 1)
+                    count += 1
+                else:
+                    moves[-1][1] = False
+        return count
+
+    def __match_idiom(self, start):
+        """Return replacement ops for the loop at start, None if no idiom."""
+        body = self.cleancode[start + 1:self.jumps[start]]
+        if not body or "[" in body or "." in body or "," in body:
+            return None
+
+        # scan loop: only pointer moves of one direction
+        if body.count(">") == len(body):
+            return [(OP_SCAN, len(body), 0)]
+        if body.count("<") == len(body):
+            return [(OP_SCAN, -len(body), 0)]
+
+        # collect the net change per cell offset
+        offset = low = high = 0
+        deltas = {}
+        turns = set()
+        for char in body:
+            if char == ">":
+                offset += 1
+                high = max(high, offset)
+            elif char == "<":
+                offset -= 1
+                low = min(low, offset)
+            else:
+                step = 1 if char == "+" else -1
+                if deltas.get(offset, 0) * step < 0:
+                    turns.add(offset)
+                deltas[offset] = deltas.get(offset, 0) + step
+        if offset or deltas.get(0, 0) not in (-1, 1):
+            return None
+        if not self.dialect["cell_wrap"] and (deltas[0] == 1 or turns):
+            # counting up to the wrap, or a cell going out of range and
+            # back within the body, is an error there
+            return None
+        if self.dialect["bounds"] == "error" and not all(
+                deltas.get(end) for end in (low, high) if end):
+            # the body steps beyond the cells MULADD checks
+            return None
+
+        # the loop runs data[dp] times if it counts down, -data[dp] (mod
+        # cell size) times if it counts up; flip the factors for the latter
+        sign = -deltas.pop(0)
+        ops = [(OP_MULADD, off, sign * factor)
+               for off, factor in sorted(deltas.items()) if factor]
+        ops.append((OP_SET, 0, 0))
+        return ops
+
+    def compile_python(self):
+        """Generate one python function from the IR and compile it.
+
+        The code object is cached by a hash of the clean code, the
+        dialect and whether the start is folded, so repeated runs of the
+        same program skip code generation.
+
+        returns: function(data, dp, out, inp) -> dp
+        """
+        import hashlib
+
+        if not self.ircode or self.__folded_start():
+            self.compile_ir()
+        folded = self.cstats["analysis"]["folded_ops"]
+        key = hashlib.sha256((self.cleancode
+                              + str(self.dialect.signature())
+                              + str(bool(folded))).encode()
+                             ).hexdigest()
+        code = _python_cache.get(key)
+        if code is None:
+            helpers = []
+            lines = ["def bf_main(data, dp, out, inp):"]
+            lines += self.__emit_python(0, len(self.ircode), 1, helpers)
+            lines.append("    return dp")
+            code = compile("\n".join(helpers + lines), f"<bf {key[:12]}>",
+                           "exec")
+            _python_cache[key] = code
+        namespace = {"bound": self.dp_bound, "put": self.__put_bytes}
+        exec(code, namespace)
+        return namespace["bf_main"]
+
+    def __emit_python(self, start, stop, depth, helpers, base=0):
+        """Return python source lines for IR ops start..stop-1.
+
+        Pointer moves in straight-line code are deferred and folded into
+        the cell offsets, dp is only updated before unbalanced loops and
+        scans. Balanced loops keep addressing their cells relative to the
+        deferred offset, base is that offset for their body. If the bounds
+        policy checks the pointer, every move goes through bound().
+        """
+        def cell(offset):
+            if offset > 0:
+                return f"data[dp + {offset}]"
+            if offset < 0:
+                return f"data[dp - {-offset}]"
+            return "data[dp]"
+
+        pad = "    " * depth
+        mask = f" & {self.wrapmask}" if self.dialect["cell_wrap"] else ""
+        fold = self.dp_bound is None
+        lines = []
+        offset = base
+        pc = start
+        while pc < stop:
+            op, arg, arg2 = self.ircode[pc]
+            here = cell(offset)
+            if op == OP_ADD:
+                lines.append(f"{pad}{here} = ({here} + {arg}){mask}")
+            elif op == OP_MOVE:
+                if fold:
+                    offset += arg
+                else:
+                    lines.append(f"{pad}dp = bound(dp + {arg})")
+            elif op == OP_SET:
+                target = (cell(offset + arg2) if fold
+                          else f"data[dp + {arg2}]" if arg2 else here)
+                lines.append(f"{pad}{target} = {arg}")
+            elif op == OP_MULADD:
+                # the loop may never be entered, then its cells are not
+                # touched, as in the IR engine
+                there = (cell(offset + arg) if fold
+                         else f"data[bound(dp + {arg})]")
+                lines.append(f"{pad}if {here}:")
+                lines.append(f"{pad}    {there} = ({there} + {here} * "
+                             f"{arg2}){mask}")
+            elif op == OP_OUT:
+                lines.append(f"{pad}out(0, dp + {offset})")
+            elif op == OP_WRITE:
+                lines.append(f"{pad}put({arg}, 0)")
+            elif op == OP_IN:
+                lines.append(f"{pad}inp(0, dp + {offset})")
+            elif (op == OP_JZ and arg2 and fold
+                  and depth < PY_MAX_NESTING):
+                # balanced: the body ends where it started
+                lines.append(f"{pad}while {here}:")
+                lines += (self.__emit_python(pc + 1, arg, depth + 1,
+                                             helpers, offset)
+                          or [f"{pad}    pass"])
+                pc = arg
+            else:
+                # scans and loops need the real data pointer
+                if offset:
+                    lines.append(f"{pad}dp += {offset}")
+                    offset = 0
+                if op == OP_SCAN:
+                    lines.append(f"{pad}while data[dp]:")
+                    lines.append(f"{pad}    dp += {arg}" if fold
+                                 else f"{pad}    dp = bound(dp + {arg})")
+                elif depth < PY_MAX_NESTING:
+                    lines.append(f"{pad}while data[dp]:")
+                    lines += (self.__emit_python(pc + 1, arg, depth + 1,
+                                                 helpers)
+                              or [f"{pad}    pass"])
+                    pc = arg
+                else:
+                    # too deep: continue in a fresh function
+                    name = f"bf_loop{pc}"
+                    helpers.append(f"def {name}(data, dp, out, inp):")
+                    helpers.append("    while data[dp]:")
+                    body = self.__emit_python(pc + 1, arg, 2, helpers)
+                    helpers += body or ["        pass"]
+                    helpers.append("    return dp")
+                    lines.append(f"{pad}dp = {name}(data, dp, out, inp)")
+                    pc = arg
+            pc += 1
+        if offset != base:
+            lines.append(f"{pad}dp += {offset - base}")
+        return lines
+
+    def compile_c(self):
+        """Generate C from the IR and build it into a shared object.
+
+        Built objects are stored in CACHE_DIR, named by a hash of their
+        source, so only the first run of a program pays for the compiler.
+
+        returns: ctypes function(data, len_data, dp, out, inp, put)
+            -> dp, None if no working C compiler is available, the tape is
+            unbounded or cells must not wrap
+        """
+        if (self.dialect["bounds"] == "extend"
+                or not self.dialect["cell_wrap"]):
+            return None
+        import ctypes
+        import hashlib
+
+        if not self.ircode or self.__folded_start():
+            self.compile_ir()
+        source = "\n".join(self.__emit_c()) + "\n"
+        key = hashlib.sha256(source.encode()).hexdigest()
+        if key in _c_libs:
+            return _c_libs[key]
+
+        libpath = os.path.join(CACHE_DIR, f"bf_{key[:32]}.so")
+        if not os.path.exists(libpath):
+            import shutil
+            import subprocess
+            import tempfile
+
+            compiler = shutil.which(os.environ.get("CC", "cc"))
+            if compiler is None:
+                return None
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with tempfile.TemporaryDirectory(dir=CACHE_DIR) as tmpdir:
+                srcpath = os.path.join(tmpdir, "bf.c")
+                tmplib = os.path.join(tmpdir, "bf.so")
+                with open(srcpath, "w") as srcfile:
+                    srcfile.write(source)
+                result = subprocess.run([compiler, "-O2", "-shared", "-fPIC",
+                                         "-o", tmplib, srcpath],
+                                        capture_output=True)
+                if result.returncode:
+                    return None
+                # atomic, concurrent builds of the same program are fine
+                os.replace(tmplib, libpath)
+
+        func = ctypes.CDLL(libpath).bf_main
+        func.restype = ctypes.c_long
+        func.argtypes = [ctypes.c_void_p, ctypes.c_long, ctypes.c_long,
+                         _c_io_func(), _c_io_func(), _c_io_func()]
+        _c_libs[key] = func
+        return func
+
+    def __emit_c(self):
+        """Return C source lines for the IR.
+
+        With the "wrap" policy the pointer wraps around at every move, with
+        "error" bf_main returns -1 as soon as it leaves the tape. With
+        "ignore" moves are not checked, cells are looked up like python
+        does, negative positions from the end, and bf_main returns -1 on
+        a cell outside of [-len, len). It returns -2 if an i/o callback
+        failed.
+        """
+        celltype = C_CELL_TYPES[self.dialect["cell_bits"]]
+        ignore = self.dialect["bounds"] == "ignore"
+        lines = ["#include <stdint.h>"]
+        if ignore:
+            lines += ["#include <setjmp.h>",
+                      "",
+                      f"static inline {celltype} *cell({celltype} *data, "
+                      "long len, long i,",
+                      "                               jmp_buf *fail)",
+                      "{",
+                      "    if (i < -len || i >= len) longjmp(*fail, 1);",
+                      "    return data + (i < 0 ? i + len : i);",
+                      "}",
+                      "",
+                      "#define CELL(i) (*cell(data, len, (i), &fail))"]
+        lines += ["",
+                  "typedef int (*io_fn)(long, long);",
+                  "",
+                  f"long bf_main({celltype} *data, long len, long dp,",
+                  "             io_fn out, io_fn inp, io_fn put)",
+                  "{"]
+        if ignore:
+            lines += ["    jmp_buf fail;",
+                      "    if (setjmp(fail)) return -1;"]
+        pad = "    "
+        if self.dialect["bounds"] == "wrap":
+            check = " dp = (dp % len + len) % len;"
+        elif ignore:
+            check = ""
+        else:
+            check = " if (dp < 0 || dp >= len) return -1;"
+
+        def at(index):
+            return f"CELL({index})" if ignore else f"data[{index}]"
+
+        for op, arg, arg2 in self.ircode:
+            if op == OP_ADD:
+                lines.append(f"{pad}{at('dp')} += {arg};")
+            elif op == OP_MOVE:
+                lines.append(f"{pad}dp += {arg};{check}")
+            elif op == OP_SET:
+                lines.append(f"{pad}{at(f'dp + {arg2}')} = {arg};")
+            elif op == OP_MULADD:
+                # a loop never entered does not touch its cells
+                lines.append(f"{pad}if ({at('dp')}) {{ long home = dp; "
+                             f"dp += {arg};{check}")
+                lines.append(f"{pad}  {at('dp')} += {at('home')} * {arg2};"
+                             " dp = home; }")
+            elif op == OP_SCAN:
+                lines.append(f"{pad}while ({at('dp')}) {{")
+                lines.append(f"{pad}    dp += {arg};{check}")
+                lines.append(f"{pad}}}")
+            elif op == OP_OUT:
+                lines.append(f"{pad}if (out(0, dp)) return -2;")
+            elif op == OP_WRITE:
+                lines.append(f"{pad}if (put({arg}, 0)) return -2;")
+            elif op == OP_IN:
+                lines.append(f"{pad}if (inp(0, dp)) return -2;")
+            elif op == OP_JZ:
+                lines.append(f"{pad}while ({at('dp')}) {{")
+                pad += "    "
+            elif op == OP_JNZ:
+                pad = pad[:-4]
+                lines.append(f"{pad}}}")
+        if ignore:
+            # the caller reads the last cell, it has to be on the tape
+            lines.append("    if (dp < -len || dp >= len) return -1;")
+            lines.append("    if (dp < 0) dp += len;")
+        lines.append("    return dp;")
+        lines.append("}")
+        return lines
+
+    def __run_c(self, func, dp):
+        """Execute natively compiled func, return data pointer."""
+        import ctypes
+
+        # the tape is shared with C, no copies
+        name = C_CELL_TYPES[self.dialect["cell_bits"]]
+        celltype = getattr(ctypes, "c_" + name[:-2])
+        buf = (celltype * len(self.data)).from_buffer(self.data)
+        self.__c_error = None
+        dp = func(buf, len(self.data), dp,
+                  self.__c_callback(self.__out_dbyte),
+                  self.__c_callback(self.__in_dbyte),
+                  self.__c_callback(self.__put_bytes))
+        del buf
+        if dp == -2:
+            raise self.__c_error
+        if dp < 0:
+            raise IndexError("data pointer out of range")
+        return dp
+
+    def __c_callback(self, method):
+        """Wrap i/o method for C, exceptions stop the native code."""
+        def callback(ip, dp):
+            try:
+                method(ip, dp)
+            except BaseException as err:
+                # ctypes would print and drop it, hand it to __run_c
+                self.__c_error = err
+                return 1
+            return 0
+        return _c_io_func()(callback)
+
     def __inc_dpointer(self, ip, dp):
         """Increase data pointer by one."""
+        if self.dp_bound:
+            return (ip + 1), self.dp_bound(dp + 1)
         return (ip + 1), (dp + 1)
 
     def __dec_dpointer(self, ip, dp):
         """Decrease data pointer by one."""
+        if self.dp_bound:
+            return (ip + 1), self.dp_bound(dp - 1)
         return (ip + 1), (dp - 1)
 
+    def __check_dpointer(self, dp):
+        """Return dp, raise IndexError if it is off the tape."""
+        if not 0 <= dp < len(self.data):
+            raise IndexError(f"data pointer out of range: {dp}")
+        return dp
+
+    def __wrap_dpointer(self, dp):
+        """Return dp wrapped around to the other end of the tape."""
+        return dp % len(self.data)
+
     def __inc_dbyte(self, ip, dp):
         """Increase byte at data pointer by one."""
-        self.data[dp] = (self.data[dp] + 1) & 255
+        self.data[dp] = (self.data[dp] + 1) & self.wrapmask
         return (ip + 1), dp
 
     def __dec_dbyte(self, ip, dp):
         """Decrease byte at data pointer by one."""
-        self.data[dp] = (self.data[dp] - 1) & 255
+        self.data[dp] = (self.data[dp] - 1) & self.wrapmask
         return (ip + 1), dp
 
     def __out_dbyte(self, ip, dp):
-        """Output one byte (ASCII) from data pointer to stdout."""
-        if not self.isdebug:
-            # no debug mode? print now
-            print(chr(self.data[dp]), end="")
-        self.output_cache.append(self.data[dp])
+        """Output one byte from data pointer to the sink."""
+        if self.crlf and self.data[dp] == 10:
+            self.sink.write_byte(13)
+        self.sink.write_byte(self.data[dp] & 255)
         return (ip + 1), dp
 
+    def __put_bytes(self, index, dp):
+        """Output the bytes of a WRITE op, see compile_ir()."""
+        chunk = self.irconst[index]
+        self.sink.write(chunk.replace(b"\n", b"\r\n") if self.crlf else chunk)
+
     def __in_dbyte(self, ip, dp):
-        """Read one character from stdin and write at current data pointer."""
-        in_byte = input("pls input one character: ")
-        if in_byte == "":
-            self.data[dp] = 0
+        """Read one byte from the source and write at current data pointer."""
+        if not self.source.pending():
+            # about to block, show everything asked so far
+            self.sink.flush()
+        in_byte = self.source.read_byte()
+        while in_byte == 13 and self.crlf:
+            in_byte = self.source.read_byte()
+        if in_byte is None:
+            if self.eof_value is not None:
+                self.data[dp] = self.eof_value
         else:
-            self.data[dp] = ord(in_byte[0])
+            self.data[dp] = in_byte & self.cellmask
         return (ip + 1), dp
 
     def __jzf_block(self, ip, dp):
@@ -239,68 +1703,1357 @@ class bf_program:
         if self.data[dp]:
             return (ip + 1), dp
         else:
-            return (list(self.codestr[ip:]).index("]") + ip + 1), dp
+            return (self.jumps[ip] + 1), dp
 
     def __jzb_block(self, ip, dp):
         """Jump if zero, backward to 1st instruction after block begin."""
         if self.data[dp]:
-            return (self.codestr.rfind("[", 0, ip) + 1), dp
+            return (self.jumps[ip] + 1), dp
         else:
             return (ip + 1), dp
 
-    def __fixlenstr(self, obj, length, fill=" "):
-        """Convert obj to str of fixed length, if possible."""
-        shortstr = str(obj)
-        longstr = "".join([fill] * (length - len(shortstr))) + shortstr
-        return longstr
-
-    def debug_output(self, ip, dp):
-        """Provide verbose output and single-step-execution in debug mode."""
-        os.system("clear")
-        print(f"Output ({len(self.output_cache)} characters): "
-              + "".join([chr(character) for character in self.output_cache])
-              + "\n")
-        print(f"Instruction Pointer: {ip}, Data Pointer: {dp}\n")
-        print("Code:", self.codestr)
-        print("IP:   " + "".join(["-"] * (ip)) + "|"
-              + "".join(["-"] * (len(self.codestr) - ip - 2)), "\n")
-        print("Data: " + "|".join([self.__fixlenstr(elm, 3)
-              for elm in self.data[:30]]))
-        print("DP:   " + "".join(["--- "] * (dp)) + "||| "
-              + "".join(["--- "] * (30 - dp - 1)), "\n")
-        input("<enter> to execute ...")
-        return None
-
-    def run(self):
-        """Run the program."""
+    def tape_view(self, start, stop):
+        """Return cells start..stop-1, a zero-copy view if possible."""
+        if isinstance(self.data, paged_tape):
+            return self.data[start:stop]
+        return memoryview(self.data)[start:stop]
+
+    def share_tape(self, path):
+        """Move the tape into the file at path, mapped into memory.
+
+        A tape_monitor in another process can open the file and read the
+        tape and a state header (running, ip, dp, steps, output bytes) at
+        any time. The IR engine updates the state at its limit checks,
+        every LIMIT_CHECK_INTERVAL steps at most, and every backend when
+        the program stops, so there is no cost per step beyond the cell
+        access through a memoryview. The tape is shared until
+        set_dialect() starts over with a private one.
+
+        Raises ValueError for an unbounded tape.
+        """
+        if isinstance(self.data, paged_tape):
+            raise ValueError("cannot share an unbounded tape")
+        raw = memoryview(self.data).cast("B")
+        with open(path, "w+b") as tapefile:
+            tapefile.truncate(MONITOR_TAPE_OFFSET + len(raw))
+            tape_map = mmap.mmap(tapefile.fileno(), 0)
+        _monitor_header.pack_into(tape_map, 0, MONITOR_MAGIC, MONITOR_VERSION,
+                                  self.dialect["cell_bits"], len(self.data),
+                                  os.getpid())
+        tape_map[MONITOR_TAPE_OFFSET:] = raw
+        self.data = memoryview(tape_map)[MONITOR_TAPE_OFFSET:].cast(
+                getattr(self.data, "typecode", "B"))
+        self.tape_map = tape_map
+        self.__tape_seq = 0
+        self.__publish(False, -1, 0, None)
+
+    def __publish(self, running, pc, dp, steps):
+        """Write the state header of a shared tape, see share_tape()."""
+        # a reader retries while the counter is odd or has changed
+        offset = _monitor_header.size
+        self.__tape_seq += 1
+        _monitor_seq.pack_into(self.tape_map, offset, self.__tape_seq)
+        _monitor_state.pack_into(self.tape_map, offset + _monitor_seq.size,
+                                 running, pc, dp,
+                                 -1 if steps is None else steps,
+                                 self.sink.count)
+        self.__tape_seq += 1
+        _monitor_seq.pack_into(self.tape_map, offset, self.__tape_seq)
+
+    def __run_ir(self, pc, dp, steps, pause=None):
+        """Execute the intermediate representation from pc.
+
+        Stops at the end of the program, at the first loop back edge after
+        pause steps or at input from a starved push source. Limits are
+        only checked at back edges, so the straight-line ops stay free of
+        checks. The loop itself is generated for the dialect, see
+        _ir_loop().
+
+        returns: pc, dp, steps
+        """
+        stop = min([limit for limit in (self.limits["steps"], pause)
+                    if limit is not None], default=None)
+        engine = _ir_loop(self.dialect["cell_wrap"], self.dialect["bounds"])
+        return engine(self, pc, dp, steps, pause, stop, self.__out_dbyte,
+                      self.__in_dbyte, self.__put_bytes, self.__check_limits)
+
+    def __check_limits(self, steps, clock, pc, dp):
+        """Raise bf_limit_error if any execution limit is exceeded.
+
+        Also the point where the IR engine updates a shared tape's state.
+        """
+        if self.tape_map is not None:
+            self.__publish(True, pc, dp, steps)
+        limits = self.limits
+        if limits["steps"] is not None and steps >= limits["steps"]:
+            raise bf_limit_error(f"step limit reached: {steps}")
+        if limits["seconds"] is not None:
+            seconds = time.perf_counter() - clock
+            if self.state is not None:
+                seconds += self.state["seconds"]
+            if seconds > limits["seconds"]:
+                raise bf_limit_error(f"time limit reached: {seconds:.3f} s")
+        if limits["output"] is not None and (self.sink.count
+                                             > limits["output"]):
+            raise bf_limit_error(f"output limit reached: {self.sink.count}"
+                                 " bytes")
+        if limits["cells"] is not None:
+            cells = (len(self.data.pages) * self.data.page_size
+                     if isinstance(self.data, paged_tape)
+                     else len(self.data))
+            if cells > limits["cells"]:
+                raise bf_limit_error(f"tape limit reached: {cells} cells")
+
+    def __next_check(self, steps):
+        """Return the step count of the next limit check after steps."""
+        next_check = steps + LIMIT_CHECK_INTERVAL
+        if self.limits["steps"] is not None:
+            next_check = min(next_check, self.limits["steps"])
+        return next_check
+
+    def resume(self, steps=None):
+        """Run the program on the IR engine for about steps more steps.
+
+        The first call starts the program, every further call continues
+        where the previous one paused. Pauses happen at loop back edges, so
+        a slice may run a little longer than steps, and at input when a
+        push source is starved. A scheduler can interleave many programs
+        this way.
+
+        returns: True if the program has finished, False if paused
+        """
+        if self.state is None:
+            self.__start_state()
+        state = self.state
+        pause = None if steps is None else state["steps"] + steps
+        try:
+            # a finished program still hands over what it wrote before
+            if state["pc"] < len(self.ircode):
+                state["pc"], state["dp"], state["steps"] = self.__run_ir(
+                        state["pc"], state["dp"], state["steps"], pause)
+        finally:
+            self.sink.flush()
+            if self.tape_map is not None:
+                self.__publish(False, state["pc"], state["dp"],
+                               state["steps"])
+        return state["pc"] >= len(self.ircode)
+
+    def __start_state(self):
+        """Set self.state to the start of the program."""
+        if not self.ircode or self.__folded_start():
+            self.compile_ir()
+        self.state = {"pc": 0, "dp": 0, "steps": 0, "seconds": 0.0}
+
+    def snapshot(self):
+        """Return the state of the IR engine, see resume(), with the tape.
+
+        An unbounded tape is shared copy-on-write, a fixed one copied in one
+        go, a shared one into a private tape. "output" and "input" record
+        the bytes written so far and the bytes buffered but not yet read;
+        restore() does not rewind I/O.
+        """
+        if self.state is None:
+            self.__start_state()
+        return {
+               "state": dict(self.state),
+               "tape": (self.data.fork() if isinstance(self.data, paged_tape)
+                        else self.__tape_copy()),
+               "output": self.sink.count,
+               "input": self.source.pending()
+               }
+
+    def restore(self, snapshot):
+        """Return to a state taken by snapshot(), resume() continues there.
+
+        The snapshot stays untouched and can be restored again.
+        """
+        tape = snapshot["tape"]
+        if self.tape_map is not None:
+            # stay in the shared file
+            self.data.cast("B")[:] = memoryview(tape).cast("B")
+        else:
+            self.data = (tape.fork() if isinstance(tape, paged_tape)
+                         else tape[:])
+        self.state = dict(snapshot["state"])
+        self.steps = self.state["steps"]
+
+    def __tape_copy(self):
+        """Return a private copy of a fixed or shared tape."""
+        if self.tape_map is None:
+            return self.data[:]
+        tape = make_tape(self.dialect["cell_bits"], len(self.data))
+        memoryview(tape).cast("B")[:] = self.data.cast("B")
+        return tape
+
+    def fork(self, source=None, sink=None):
+        """Return an independent copy paused at the current state.
+
+        Like spawn(), but the copy continues with resume() where this
+        program is, on a copy of its tape.
+        """
+        child = self.spawn(source, sink)
+        child.restore(self.snapshot())
+        return child
+
+    def prime(self, max_steps=None):
+        """Run from the start up to the first input, pause there.
+
+        The input independent prefix of the program runs once, fork()
+        then continues it for every input. The prefix output is captured
+        instead of written to self.sink, forks have to replay it.
+
+        max_steps: give up after about that many steps
+        returns: the prefix output, None if max_steps ran out first
+        """
+        prefix = bytearray()
+        source, sink = self.source, self.sink
+        self.source = byte_source(None)
+        self.sink = byte_sink(prefix.extend, "block")
+        self.state = None
+        try:
+            finished = self.resume(max_steps)
+        finally:
+            self.source, self.sink = source, sink
+        if not finished and self.ircode[self.state["pc"]][0] != OP_IN:
+            return None
+        return bytes(prefix)
+
+    def run_lanes(self, inputs):
+        """Run the program once per input, all runs in lockstep.
+
+        The IR executes on a NumPy tape with one row (lane) per input,
+        every op once for all lanes. Lanes whose cell is zero at a loop
+        skip it masked while the others run it, so control flow may
+        differ between lanes. Lanes that leave the tape are split off and
+        run on their own with run(), as are all lanes if NumPy is missing,
+        cells do not wrap, the tape is unbounded or limits are set.
+
+        inputs: list of bytes
+        returns: list of dicts with "output" (bytes) and "exit", "error"
+            instead of "exit" if that run failed
+        """
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if (numpy is None or not self.dialect["cell_wrap"]
+                or self.dialect["bounds"] == "extend"
+                or any(limit is not None for limit in self.limits.values())):
+            return [self.__run_lane(inp) for inp in inputs]
+        if not self.ircode:
+            self.compile_ir()
+        ir = self.ircode
+        size = self.dialect["len_data"]
+        wrap = self.dialect["bounds"] == "wrap"
+        # unsigned numpy arithmetic wraps around just like the cells
+        celltype = getattr(numpy,
+                           C_CELL_TYPES[self.dialect["cell_bits"]][:-2])
+
+        def word(value):
+            return celltype(value & self.cellmask)
+
+        tape = numpy.zeros((len(inputs), size), dtype=celltype)
+        dp = numpy.zeros(len(inputs), dtype=numpy.int64)
+        # the scalar engine skips every 13 in crlf mode, drop them now
+        lane_inputs = [bytes(inp).replace(b"\r", b"") if self.crlf
+                       else bytes(inp) for inp in inputs]
+        lengths = numpy.array([len(inp) for inp in lane_inputs],
+                              dtype=numpy.int64)
+        inbuf = numpy.zeros((len(inputs), int(lengths.max(initial=0)) + 1),
+                            dtype=celltype)
+        for lane, inp in enumerate(lane_inputs):
+            inbuf[lane, :len(inp)] = numpy.frombuffer(inp, dtype=numpy.uint8)
+        in_pos = numpy.zeros(len(inputs), dtype=numpy.int64)
+        alive = numpy.ones(len(inputs), dtype=bool)
+        # active lanes, and the active lanes outside each entered loop
+        rows = numpy.arange(len(inputs))
+        outer = []
+        events = []
+
+        def move(lanes, step):
+            # returns the lanes still on the tape
+            dp[lanes] += step
+            if wrap:
+                dp[lanes] %= size
+                return lanes
+            off = (dp[lanes] < 0) | (dp[lanes] >= size)
+            alive[lanes[off]] = False
+            return lanes[~off]
+
+        pc = 0
+        while pc < len(ir) and alive.any():
+            op, arg, arg2 = ir[pc]
+            here = dp[rows]
+            if op == OP_ADD:
+                tape[rows, here] += word(arg)
+            elif op == OP_MOVE:
+                rows = move(rows, arg)
+            elif op == OP_SET:
+                tape[rows, here + arg2] = arg
+            elif op == OP_MULADD:
+                lanes = rows[tape[rows, here] != 0]
+                values = tape[lanes, dp[lanes]]
+                lanes_there = move(lanes, arg)
+                there = dp[lanes_there]
+                dp[lanes] -= arg
+                if wrap:
+                    dp[lanes] %= size
+                values = values[alive[lanes]]
+                tape[lanes_there, there] += values * word(arg2)
+                rows = rows[alive[rows]]
+            elif op == OP_SCAN:
+                lanes = rows[tape[rows, here] != 0]
+                while lanes.size:
+                    lanes = move(lanes, arg)
+                    lanes = lanes[tape[lanes, dp[lanes]] != 0]
+                rows = rows[alive[rows]]
+            elif op == OP_OUT:
+                events.append((rows, tape[rows, here]))
+            elif op == OP_WRITE:
+                for value in self.irconst[arg]:
+                    events.append((rows, numpy.full(rows.size, value,
+                                                    dtype=celltype)))
+            elif op == OP_IN:
+                has = in_pos[rows] < lengths[rows]
+                lanes = rows[has]
+                tape[lanes, dp[lanes]] = inbuf[lanes, in_pos[lanes]]
+                in_pos[lanes] += 1
+                if self.eof_value is not None:
+                    lanes = rows[~has]
+                    tape[lanes, dp[lanes]] = self.eof_value
+            elif op == OP_JZ:
+                outer.append(rows)
+                rows = rows[tape[rows, here] != 0]
+                if not rows.size:
+                    rows = outer.pop()
+                    rows = rows[alive[rows]]
+                    pc = arg
+            elif op == OP_JNZ:
+                rows = rows[tape[rows, here] != 0]
+                if rows.size:
+                    pc = arg
+                else:
+                    rows = outer.pop()
+                    rows = rows[alive[rows]]
+            pc += 1
+
+        # output values per lane, in order of execution
+        if events:
+            lanes = numpy.concatenate([lanes for lanes, values in events])
+            values = numpy.concatenate([values for lanes, values in events])
+            order = numpy.argsort(lanes, kind="stable")
+            lanes = lanes[order]
+            values = values[order]
+            starts = numpy.searchsorted(lanes, numpy.arange(len(inputs) + 1))
+        results = []
+        for lane, inp in enumerate(inputs):
+            if not alive[lane]:
+                results.append(self.__run_lane(inp))
+                continue
+            output = b""
+            if events:
+                lane_values = values[starts[lane]:starts[lane + 1]]
+                output = lane_values.astype(numpy.uint8).tobytes()
+                if self.crlf:
+                    output = bytes(byte for value in lane_values.tolist()
+                                   for byte in ((13, 10) if value == 10
+                                                else (value & 255,)))
+            results.append({"output": output,
+                            "exit": int(tape[lane, dp[lane]])})
+        return results
+
+    def __run_lane(self, inp):
+        """Run a copy of the program on one input, see run_lanes()."""
+        output = io.BytesIO()
+        prog = self.spawn(inp, output)
+        result = {}
+        try:
+            result["exit"] = prog.run(verbose=False)
+        except Exception as err:
+            result["error"] = f"{type(err).__name__}: {err}"
+        result["output"] = output.getvalue()
+        return result
+
+    def __run_profiled(self, dp):
+        """Execute clean code like the reference backend, count everything.
+
+        A separate loop, so unprofiled runs pay nothing for profiling.
+        Fills self.profile with execution counts per clean code position,
+        taken jumps per bracket and accesses per tape cell.
+
+        returns: data pointer
+        """
+        code = self.cleancode
+        jumps = self.jumps
+        data = self.data
+        mask = self.wrapmask
+        bound = self.dp_bound
+        counts = array("Q", bytes(8 * len(code)))
+        taken = array("Q", bytes(8 * len(code)))
+        cells = {}
+        ip = 0
+        steps = 0
+        clock = time.perf_counter()
+        next_check = self.__next_check(steps)
+        try:
+            while ip < len(code):
+                char = code[ip]
+                counts[ip] += 1
+                steps += 1
+                if steps >= next_check:
+                    self.__check_limits(steps, clock, -1, dp)
+                    next_check = self.__next_check(steps)
+                if char == ">" or char == "<":
+                    dp += 1 if char == ">" else -1
+                    if bound:
+                        dp = bound(dp)
+                    ip += 1
+                    continue
+                cells[dp] = cells.get(dp, 0) + 1
+                if char == "+":
+                    data[dp] = (data[dp] + 1) & mask
+                elif char == "-":
+                    data[dp] = (data[dp] - 1) & mask
+                elif char == "[":
+                    if data[dp]:
+                        # entering the body
+                        taken[ip] += 1
+                    else:
+                        ip = jumps[ip]
+                elif char == "]":
+                    if data[dp]:
+                        taken[ip] += 1
+                        ip = jumps[ip]
+                elif char == ".":
+                    self.__out_dbyte(ip, dp)
+                else:
+                    self.__in_dbyte(ip, dp)
+                ip += 1
+        finally:
+            # a failed run keeps the profile up to the failing command
+            self.steps = steps
+            self.profile = {"counts": counts, "taken": taken, "cells": cells}
+            if self.tape_map is not None:
+                self.__publish(False, -1, dp, steps)
+        return dp
+
+    def profile_data(self):
+        """Return the last profile as a JSON-ready dict.
+
+        instructions: per executed command its source offset and count
+        loops: per loop its source span, nesting depth, entries (times the
+            loop was reached), iterations (times the body ran), steps
+            inside and average trip count
+        cells: accesses per tape cell
+        """
+        counts = self.profile["counts"]
+        taken = self.profile["taken"]
+        # prefix sums give the steps inside any span in O(1)
+        prefix = [0]
+        for count in counts:
+            prefix.append(prefix[-1] + count)
+        loops = []
+        depth = 0
+        for pos, char in enumerate(self.cleancode):
+            if char == "[":
+                end = self.jumps[pos]
+                iterations = taken[pos] + taken[end]
+                loops.append({
+                             "pos": pos,
+                             "offset": self.codepos[pos],
+                             "end_offset": self.codepos[end],
+                             "depth": depth,
+                             "entries": counts[pos],
+                             "iterations": iterations,
+                             "steps": prefix[end + 1] - prefix[pos],
+                             "avg_trip": (iterations / counts[pos]
+                                          if counts[pos] else 0.0)
+                             })
+                depth += 1
+            elif char == "]":
+                depth -= 1
+        return {
+               "steps": prefix[-1],
+               "instructions": [{
+                                "pos": pos,
+                                "offset": self.codepos[pos],
+                                "char": self.cleancode[pos],
+                                "count": count
+                                } for pos, count in enumerate(counts)
+                                if count],
+               "loops": loops,
+               "cells": {str(cell): count for cell, count
+                         in sorted(self.profile["cells"].items())}
+               }
+
+    def profile_folded(self):
+        """Return the last profile as folded stacks for flamegraph tools.
+
+        One line per loop nesting path: the enclosing loops by source
+        offset, then the steps spent directly in the innermost loop.
+        """
+        counts = self.profile["counts"]
+        stack = ["program"]
+        folded = {}
+        for pos, char in enumerate(self.cleancode):
+            if char == "[":
+                stack.append(f"loop@{self.codepos[pos]}")
+            path = ";".join(stack)
+            folded[path] = folded.get(path, 0) + counts[pos]
+            if char == "]":
+                stack.pop()
+        return [f"{path} {count}" for path, count in folded.items() if count]
+
+    def profile_report(self, top=10):
+        """Return a text report of the hottest loops and cells."""
+        profile = self.profile_data()
+        total = profile["steps"] or 1
+        lines = [f"{profile['steps']} steps", "",
+                 "hot loops (source offsets, share of all steps):"]
+        for loop in sorted(profile["loops"], key=lambda loop: loop["steps"],
+                           reverse=True)[:top]:
+            lines.append(f"  {loop['offset']:>6}-{loop['end_offset']:<6} "
+                         f"{100 * loop['steps'] / total:5.1f} %  "
+                         f"entries {loop['entries']}, "
+                         f"avg trip {loop['avg_trip']:.1f}  "
+                         + self.codestr[loop["offset"]:loop["end_offset"]
+                                        + 1][:40].replace("\n", " "))
+        lines += ["", "hot cells (accesses):"]
+        for cell, count in sorted(profile["cells"].items(),
+                                  key=lambda item: item[1],
+                                  reverse=True)[:top]:
+            lines.append(f"  {cell:>6} {count}")
+        return "\n".join(lines)
+
+    def analysis_report(self):
+        """Return a text report of what compile_ir() did to the program."""
+        if not self.ircode:
+            self.compile_ir()
+        stats = self.cstats["analysis"]
+        loops = stats["loops"]
+        return "\n".join([
+                f"{len(self.cleancode)} commands -> {stats['ir_ops']} IR ops",
+                f"start folded: {stats['folded_ops']} ops, "
+                f"{stats['folded_steps']} steps saved, "
+                f"{stats['dead_loops']} dead loops removed",
+                f"output precomputed: {stats['output_ops']} output ops "
+                f"-> {stats['write_ops']} writes",
+                f"loops: {loops}, balanced {stats['balanced_loops']}, "
+                f"unbalanced {loops - stats['balanced_loops']}"])
+
+    def set_breakpoint(self, offset):
+        """Trap before the first command at or after source offset.
+
+        returns: clean code position of the breakpoint
+        """
+        if not self.parsed:
+            self.parse_code()
+        pos = bisect_left(self.codepos, offset)
+        self.breakpoints.add(pos)
+        return pos
+
+    def add_marker_breakpoints(self, source=None):
+        """Set a breakpoint at every # marker in source (default: codestr).
+
+        Markers are comments, so they are only looked for here and cost
+        nothing while parsing.
+
+        returns: number of markers found
+        """
+        source = self.codestr if source is None else source
+        offsets = [match.start() for match in re.finditer("#", source)]
+        for offset in offsets:
+            self.set_breakpoint(offset)
+        return len(offsets)
+
+    def set_watchpoint(self, cell, condition=None):
+        """Trap when a command changes the cell at tape position cell.
+
+        condition: None traps at any change, a function of the new value
+            traps only where it returns True, an int at that value
+        """
+        if isinstance(condition, int):
+            self.watchpoints[cell] = condition.__eq__
+        else:
+            self.watchpoints[cell] = condition
+
+    def clear_traps(self):
+        """Remove all breakpoints and watchpoints."""
+        self.breakpoints.clear()
+        self.watchpoints.clear()
+
+    def __report_trap(self, event):
+        """Default trap handler, describe the trap on stderr."""
+        start = max(0, event["dp"] - 4)
+        cells = " ".join(f"{value:>3}"
+                         for value in self.tape_view(start, start + 9))
+        print(f"\n{event['reason']} at offset {event['offset']}, ip "
+              f"{event['ip']}, dp {event['dp']}, step {event['steps']}: "
+              f"tape[{start}:] {cells}", file=sys.stderr, flush=True)
+
+    def __run_traced(self, dp):
+        """Execute clean code like the reference backend, check traps.
+
+        Only used while breakpoints or watchpoints are set, so other runs
+        pay nothing for them. Breakpoints trap before their command runs,
+        watchpoints after the command that changed the cell. Each trap
+        calls self.on_trap (default: a report on stderr) with an event
+        dict: reason ("breakpoint" or "watchpoint"), ip, offset, dp, cell,
+        value, steps.
+        """
+        code = self.cleancode
+        commands = [self.commands[char]["method"] for char in code]
+        breakpoints = self.breakpoints
+        watchpoints = self.watchpoints
+        on_trap = self.on_trap or self.__report_trap
+        ip = 0
+        steps = 0
+        clock = time.perf_counter()
+        next_check = self.__next_check(steps)
+
+        def trap(reason, ip, cell):
+            on_trap({
+                    "reason": reason,
+                    "ip": ip,
+                    "offset": self.codepos[ip] if ip < len(code) else None,
+                    "dp": dp,
+                    "cell": cell,
+                    "value": self.data[cell],
+                    "steps": steps
+                    })
+
+        try:
+            while ip < len(code):
+                if ip in breakpoints:
+                    trap("breakpoint", ip, dp)
+                steps += 1
+                if steps >= next_check:
+                    self.__check_limits(steps, clock, -1, dp)
+                    next_check = self.__next_check(steps)
+                if dp in watchpoints and code[ip] in "+-,":
+                    old = self.data[dp]
+                    next_ip, dp = commands[ip](ip, dp)
+                    value = self.data[dp]
+                    condition = watchpoints[dp]
+                    if value != old and (condition is None
+                                         or condition(value)):
+                        trap("watchpoint", ip, dp)
+                    ip = next_ip
+                else:
+                    ip, dp = commands[ip](ip, dp)
+        finally:
+            self.steps = steps
+            if self.tape_map is not None:
+                self.__publish(False, -1, dp, steps)
+        return dp
+
+    def spawn(self, source=None, sink=None):
+        """Return a new instance of the same program with a fresh tape.
+
+        Parsed code and IR are shared, not rebuilt, limits are copied.
+        """
+        child = bf_program(self.codestr, self.isdebug, self.dialect,
+                           source, sink, self.limits)
+        child.cleancode = self.cleancode
+        child.parsed = self.parsed
+        child.brackets = self.brackets
+        child.jumps = self.jumps
+        child.codepos = self.codepos
+        child.cstats = self.cstats
+        child.ircode = self.ircode
+        child.irconst = self.irconst
+        return child
+
+    async def run_async(self, reader=None, writer=None,
+                        slice_steps=ASYNC_SLICE_STEPS):
+        """Run the program on the IR engine as a coroutine.
+
+        reader: asyncio.StreamReader or asyncio.Queue of bytes chunks
+            (None or b"" ends the input), default self.source
+        writer: asyncio.StreamWriter or asyncio.Queue receiving bytes
+            chunks, default self.sink
+        The event loop gets control back every slice_steps steps and
+        whenever the program waits for input.
+
+        returns: byte lastly pointed to
+        """
+        import asyncio
+
+        chunks = []
+        if reader is not None:
+            self.source = byte_source(None)
+        if writer is not None:
+            self.sink = byte_sink(chunks.append, "block")
+
+        self.state = None
+        while True:
+            finished = self.resume(slice_steps)
+            for chunk in chunks:
+                if isinstance(writer, asyncio.Queue):
+                    await writer.put(chunk)
+                else:
+                    writer.write(chunk)
+                    await writer.drain()
+            chunks.clear()
+            if finished:
+                break
+            if self.source.starved():
+                if isinstance(reader, asyncio.Queue):
+                    chunk = await reader.get()
+                else:
+                    chunk = await reader.read(IO_BLOCK_SIZE)
+                if chunk:
+                    self.source.feed(chunk.encode("latin-1")
+                                     if isinstance(chunk, str) else chunk)
+                else:
+                    self.source.close()
+            else:
+                await asyncio.sleep(0)
+        return self.data[self.state["dp"]]
+
+    def guest_program(self):
+        """Return the program this one interprets, None if there is none.
+
+        If this is a known self-interpreter, see SELF_INTERPRETERS, its
+        input up to "!" is read and parsed as the guest program, which
+        reads the rest of the input. All input read is put back if there
+        is no "!", the guest has no commands or does not parse.
+        """
+        import hashlib
+
+        if not self.parsed:
+            self.parse_code()
+        if (hashlib.sha256(self.cleancode.encode()).hexdigest()[:32]
+                not in SELF_INTERPRETERS):
+            return None
+        source = self.source
+        if source.reader is None and not source.closed:
+            # push source, the guest may not even be there yet
+            return None
+        code = bytearray()
+        byte = source.read_byte()
+        while byte is not None and byte != 33:
+            code.append(byte)
+            byte = source.read_byte()
+        guest = None
+        if byte is not None and _command_re.search(code.decode("latin-1")):
+            guest = bf_program(code.decode("latin-1"), dialect=self.dialect,
+                               source=source, sink=self.sink,
+                               limits=self.limits)
+            try:
+                guest.parse_code()
+            except ValueError:
+                guest = None
+        if guest is None:
+            source.unread(code if byte is None else code + b"!")
+        return guest
+
+    def __run_guest(self, guest, backend, nested):
+        """Run the guest of an interpreter directly, see run(nested=)."""
+        if nested != "validate":
+            result = guest.run(backend, verbose=False, nested=nested)
+            self.steps = guest.steps
+            return result
+        # both runs need the input, so it is read in full
+        data = bytearray()
+        byte = guest.source.read_byte()
+        while byte is not None:
+            data.append(byte)
+            byte = guest.source.read_byte()
+        output = bytearray()
+        guest.source = byte_source(bytes(data))
+        guest.sink = byte_sink(output.extend, "block")
+        result = guest.run(backend, verbose=False, nested=nested)
+        self.steps = guest.steps
+
+        expected = bytearray()
+        real = self.spawn(guest.codestr.encode("latin-1") + b"!" + data,
+                          byte_sink(expected.extend, "block"))
+        real.limits["steps"] = VALIDATE_STEPS
+        try:
+            real.run(verbose=False)
+            finished = True
+        except bf_limit_error:
+            finished = False
+        if (output != expected if finished
+                else output[:len(expected)] != expected):
+            differ = next((pos for pos, (got, want)
+                           in enumerate(zip(output, expected))
+                           if got != want),
+                          min(len(output), len(expected)))
+            raise bf_nested_error(f"direct run of the guest program "
+                                  f"differs at output byte {differ}")
+        for value in output:
+            self.sink.write_byte(value)
+        return result
+
+    def run(self, backend="ir", verbose=True, profile=False, nested=None):
+        """Run the program.
+
+        backend: "ir" executes the optimized intermediate representation,
+            "python" compiles the IR to a python function and calls it,
+            "c" compiles the IR to native code (falls back to "python" if
+            there is no C compiler or the dialect does not allow it, see
+            compile_c()),
+            "reference" dispatches every single command
+            In debug mode the program runs in the curses debugger instead,
+            see debug_ui().
+            With any of self.limits set, "python" and "c" use "ir", the
+            compiled code does not check limits; the other interpreters
+            check them every LIMIT_CHECK_INTERVAL steps. With breakpoints or
+            watchpoints set, every backend is replaced by a checking
+            interpreter, see set_breakpoint().
+        verbose: clear the screen (a terminal only) and frame the output
+            with messages
+        profile: ignore backend and run an instrumented interpreter, see
+            profile_data(), profile_folded() and profile_report()
+        nested: for a self-interpreter, see guest_program(), "direct" runs
+            the guest program directly on backend instead of interpreting
+            it, input and output stay the same, the return value is the
+            guest's; "validate" also compares the output to a real nested
+            run of up to VALIDATE_STEPS steps, raises bf_nested_error on a
+            difference. Either applies to nested guests again.
+        """
         # startup
         data_pt = 0
         instr_pt = 0
-        os.system("clear")
-        print("Output: ")
-
-        # walk through code string
-        while instr_pt < len(self.codestr):
-            if self.codestr[instr_pt] in self.commands.keys():
-                # execute valid commands, ...
-                if self.isdebug:
-                    self.debug_output(instr_pt, data_pt)
-                instr_pt, data_pt = (self.commands[self.codestr[instr_pt]][
-                                                "method"](instr_pt, data_pt))
+        self.steps = None
+        self.state = None
+        if verbose:
+            if sys.stdout.isatty():
+                # home and erase, like clear(1) without running it
+                print("\033[H\033[2J", end="")
+            print("Output: ", flush=True)
+
+        if not self.parsed:
+            self.parse_code()
+        if self.tape_map is not None:
+            self.__publish(True, -1, 0, None)
+        guest = (self.guest_program()
+                 if nested and not (profile or self.isdebug) else None)
+        # the checking interpreters publish their own end state, their
+        # data pointer is lost here if they fail
+        checking = guest is None and (profile or not self.isdebug and bool(
+                self.breakpoints or self.watchpoints))
+        try:
+            if guest is not None:
+                result = self.__run_guest(guest, backend, nested)
+            elif profile:
+                data_pt = self.__run_profiled(data_pt)
+            elif self.isdebug:
+                data_pt = debug_ui(self)
+            elif self.breakpoints or self.watchpoints:
+                data_pt = self.__run_traced(data_pt)
+            elif backend == "reference":
+                # walk through clean code, brackets jump via self.jumps
+                code = self.cleancode
+                self.steps = 0
+                clock = time.perf_counter()
+                next_check = self.__next_check(0)
+                while instr_pt < len(code):
+                    self.steps += 1
+                    if self.steps >= next_check:
+                        self.__check_limits(self.steps, clock, -1, data_pt)
+                        next_check = self.__next_check(self.steps)
+                    instr_pt, data_pt = (self.commands[code[instr_pt]][
+                                         "method"](instr_pt, data_pt))
+            elif backend == "ir" or (backend in ("python", "c") and any(
+                    limit is not None for limit in self.limits.values())):
+                self.resume()
+                data_pt = self.state["dp"]
+            elif backend in ("python", "c"):
+                native = self.compile_c() if backend == "c" else None
+                if native is not None:
+                    data_pt = self.__run_c(native, data_pt)
+                else:
+                    data_pt = self.compile_python()(self.data, data_pt,
+                                                    self.__out_dbyte,
+                                                    self.__in_dbyte)
             else:
-                # ... ignore other stuff.
-                if not self.isdebug:
-                    if self.codestr[instr_pt] == "#":
-                        self.debug_output(self, instr_pt, data_pt)
-                        print("Output: " + ("".join([chr(character)
-                              for character in self.output_cache])))
-                instr_pt += 1
+                raise ValueError(f"unknown backend: {backend}")
+        finally:
+            self.sink.flush()
+            if (self.tape_map is not None and self.state is None
+                    and not checking):
+                # the IR engine keeps the state itself
+                self.__publish(False, -1, data_pt, self.steps)
 
         # exit; interpret byte lastly pointed to as return value
-        if self.isdebug:
-            self.debug_output(instr_pt, data_pt)
-        print("\n\nProgram finished.")
-        return self.data[data_pt]
+        if verbose:
+            print("\n\nProgram finished.")
+        return self.data[data_pt] if guest is None else result
+
+
+class bf_debugger:
+    """Reversible debugger, runs a bf_program command by command.
+
+    Every step appends (ip, dp, old cell value) to an undo log. Every
+    CHECKPOINT_INTERVAL steps the tape is checkpointed, sharing pages that
+    did not change with the previous checkpoint, and the undo log starts
+    over. Stepping back pops the undo log, or restores the nearest
+    checkpoint and replays from there. Input is recorded, so replays read
+    the same bytes, and output is kept in self.output instead of going to
+    the program's sink.
+    """
+
+    def __init__(self, program, read_input=None):
+        """Attach to program, which starts from scratch.
+
+        read_input: function returning the next input byte or None at EOF,
+            default program.source.read_byte
+        """
+        if not program.parsed:
+            program.parse_code()
+        self.program = program
+        self.read_input = read_input or program.source.read_byte
+        self.ip = 0
+        self.dp = 0
+        self.steps = 0
+        self.inputs = []
+        self.in_pos = 0
+        self.output = bytearray()
+        self.breakpoints = set(program.breakpoints)
+        self.undo_ip = array("l")
+        self.undo_dp = array("l")
+        self.undo_value = array("Q")
+        self.undo_in = array("l")
+        self.undo_out = array("l")
+        self.checkpoints = []
+        self.__checkpoint()
+
+    def finished(self):
+        """Return True if the program has ended."""
+        return self.ip >= len(self.program.cleancode)
+
+    def cell(self, pos=None):
+        """Return value of the cell at pos (default: dp), 0 if off tape."""
+        try:
+            return self.program.data[self.dp if pos is None else pos]
+        except IndexError:
+            return 0
+
+    def step(self):
+        """Execute one command, return False if the program has ended."""
+        prog = self.program
+        ip = self.ip
+        dp = self.dp
+        if ip >= len(prog.cleancode):
+            return False
+        if self.steps - self.checkpoints[-1]["steps"] >= CHECKPOINT_INTERVAL:
+            self.__checkpoint()
+        value = self.cell()
+        old_dp = dp
+        in_pos = self.in_pos
+        out_len = len(self.output)
+
+        # log the step only once it executed, a command that raises (a
+        # move off the tape under bounds "error") leaves no undo entry
+        char = prog.cleancode[ip]
+        if char == ">" or char == "<":
+            dp += 1 if char == ">" else -1
+            self.dp = prog.dp_bound(dp) if prog.dp_bound else dp
+        elif char == "+":
+            prog.data[dp] = (value + 1) & prog.wrapmask
+        elif char == "-":
+            prog.data[dp] = (value - 1) & prog.wrapmask
+        elif char == "[":
+            if not value:
+                ip = prog.jumps[ip]
+        elif char == "]":
+            if value:
+                ip = prog.jumps[ip]
+        elif char == ".":
+            if prog.crlf and value == 10:
+                self.output.append(13)
+            self.output.append(value & 255)
+        else:
+            in_byte = self.__input()
+            while in_byte == 13 and prog.crlf:
+                in_byte = self.__input()
+            if in_byte is not None:
+                prog.data[dp] = in_byte & prog.cellmask
+            elif prog.eof_value is not None:
+                prog.data[dp] = prog.eof_value
+        self.undo_ip.append(self.ip)
+        self.undo_dp.append(old_dp)
+        self.undo_value.append(value)
+        if char == ".":
+            self.undo_out.append(out_len)
+        elif char == ",":
+            self.undo_in.append(in_pos)
+        self.ip = ip + 1
+        self.steps += 1
+        return True
+
+    def __input(self):
+        """Return next input byte, recorded ones first."""
+        if self.in_pos == len(self.inputs):
+            self.inputs.append(self.read_input())
+        self.in_pos += 1
+        return self.inputs[self.in_pos - 1]
+
+    def __checkpoint(self):
+        """Store the machine state, start a new undo log."""
+        previous = self.checkpoints[-1]["tape"] if self.checkpoints else None
+        self.checkpoints.append({
+                                "steps": self.steps,
+                                "ip": self.ip,
+                                "dp": self.dp,
+                                "in_pos": self.in_pos,
+                                "out_len": len(self.output),
+                                "tape": tape_pages(self.program.data,
+                                                   previous)
+                                })
+        for log in (self.undo_ip, self.undo_dp, self.undo_value,
+                    self.undo_in, self.undo_out):
+            del log[:]
+
+    def step_back(self, count=1):
+        """Undo count steps, return number of steps undone."""
+        target = max(self.steps - count, 0)
+        start = self.steps
+        prog = self.program
+        while self.steps > target and self.undo_ip:
+            self.ip = self.undo_ip.pop()
+            self.dp = self.undo_dp.pop()
+            value = self.undo_value.pop()
+            char = prog.cleancode[self.ip]
+            if char in "+-,":
+                prog.data[self.dp] = value
+            if char == ",":
+                self.in_pos = self.undo_in.pop()
+            elif char == ".":
+                del self.output[self.undo_out.pop():]
+            self.steps -= 1
+        if self.steps > target:
+            # beyond the undo log: restore a checkpoint and replay
+            while self.checkpoints[-1]["steps"] > target:
+                self.checkpoints.pop()
+            state = self.checkpoints.pop()
+            restore_tape_pages(prog.data, state["tape"])
+            self.ip = state["ip"]
+            self.dp = state["dp"]
+            self.in_pos = state["in_pos"]
+            del self.output[state["out_len"]:]
+            self.steps = state["steps"]
+            self.checkpoints.append(state)
+            for log in (self.undo_ip, self.undo_dp, self.undo_value,
+                        self.undo_in, self.undo_out):
+                del log[:]
+            while self.steps < target:
+                self.step()
+        return start - self.steps
+
+    def run(self, max_steps=None, watch=None):
+        """Run to the next breakpoint, the end or max_steps steps.
+
+        watch: cell position, also stop as soon as its value changes
+        returns: reason for stopping: "end", "breakpoint", "watch", "steps"
+        """
+        stop = None if max_steps is None else self.steps + max_steps
+        watched = None if watch is None else self.cell(watch)
+        while True:
+            if not self.step():
+                return "end"
+            if self.ip in self.breakpoints:
+                return "breakpoint"
+            if watch is not None and self.cell(watch) != watched:
+                return "watch"
+            if stop is not None and self.steps >= stop:
+                return "steps"
+
+    def run_back(self):
+        """Step back to the previous breakpoint or the start.
+
+        returns: "start" or "breakpoint"
+        """
+        while self.steps:
+            self.step_back()
+            if self.ip in self.breakpoints:
+                return "breakpoint"
+        return "start"
+
+
+def debug_ui(program):
+    """Debug program in a curses terminal UI, return final data pointer.
+
+    keys: s / space step, b step back, c continue, r reverse continue,
+    t toggle breakpoint at ip, w run until the cell at dp changes, q quit
+    Output goes to the program's sink when the UI ends.
+    """
+    import curses
+
+    def ui(screen):
+        curses.curs_set(0)
+        interactive = (program.source.reader is not None
+                       and sys.stdin.isatty())
+
+        def read_input():
+            # the program wants a byte from the terminal
+            screen.addstr(curses.LINES - 1, 0, "input (^D: EOF): ")
+            screen.clrtoeol()
+            key = screen.getch()
+            return None if key == 4 else key & 255
+
+        debugger = bf_debugger(program, read_input if interactive else None)
+        message = "ready"
+        while True:
+            draw(screen, debugger, message)
+            key = chr(screen.getch())
+            if key == "q":
+                return debugger
+            try:
+                message = command(debugger, key) or message
+            except (IndexError, ValueError, OverflowError) as err:
+                # the failing command left no step, show it and stay put
+                message = f"{type(err).__name__}: {err}"
+
+    def command(debugger, key):
+        # carry out the command for key, return the new message
+        if key in "s ":
+            return "step" if debugger.step() else "end"
+        elif key == "b":
+            return "back" if debugger.step_back() else "start"
+        elif key == "c":
+            return debugger.run()
+        elif key == "r":
+            return debugger.run_back()
+        elif key == "w":
+            return debugger.run(watch=debugger.dp)
+        elif key == "t":
+            debugger.breakpoints ^= {debugger.ip}
+            return "breakpoint toggled"
+
+    def draw(screen, debugger, message):
+        # curses only sends the parts of the screen that changed
+        width = curses.COLS - 1
+        code = program.cleancode
+        screen.erase()
+        screen.addstr(0, 0, f"ip {debugger.ip}  dp {debugger.dp}  steps "
+                      f"{debugger.steps}  [{message}]"[:width])
+        start = max(0, debugger.ip - width // 2)
+        screen.addstr(2, 0, "code:")
+        for col, pos in enumerate(range(start, min(len(code),
+                                                   start + width))):
+            attr = curses.A_REVERSE if pos == debugger.ip else 0
+            if pos in debugger.breakpoints:
+                attr |= curses.A_UNDERLINE
+            screen.addstr(3, col, code[pos], attr)
+        screen.addstr(5, 0, "tape:")
+        first = max(0, debugger.dp - width // 10)
+        for col, pos in enumerate(range(first, first + width // 5)):
+            attr = curses.A_REVERSE if pos == debugger.dp else 0
+            screen.addstr(6, col * 5, f"{debugger.cell(pos):>4}", attr)
+        screen.addstr(8, 0, f"output ({len(debugger.output)} bytes):")
+        rows = curses.LINES - 11
+        lines = debugger.output.decode("latin-1").split("\n")[-rows:]
+        for row, line in enumerate(lines):
+            screen.addstr(9 + row, 0, line[:width])
+        screen.addstr(curses.LINES - 1, 0, "s step  b back  c continue  "
+                      "r reverse  t breakpoint  w watch cell  q quit"[:width])
+        screen.refresh()
+
+    debugger = curses.wrapper(ui)
+    for value in debugger.output:
+        program.sink.write_byte(value)
+    program.steps = debugger.steps
+    return debugger.dp
+
+
+# per worker process: parsed programs by (path, backend, dialect)
+_batch_programs = {}
+
+
+def _batch_job(job, backend, dialect, limits):
+    """Run one batch job in a worker process, return its result dict."""
+    result = {"id": job.get("id"), "program": job["program"]}
+    key = (job["program"], backend, json.dumps(dialect, sort_keys=True))
+    try:
+        if key not in _batch_programs:
+            with open(job["program"]) as progfile:
+                proto = bf_program(progfile.read(), dialect=dialect,
+                                   source=b"", sink=io.BytesIO())
+            proto.parse_code()
+            proto.compile_ir()
+            prefix = None
+            if backend == "c":
+                proto.compile_c()
+            elif backend == "python":
+                proto.compile_python()
+            elif backend == "ir":
+                prefix = proto.prime(PRIME_MAX_STEPS)
+            _batch_programs[key] = proto, prefix
+        proto, prefix = _batch_programs[key]
+
+        if "input_file" in job:
+            with open(job["input_file"], "rb") as infile:
+                source = infile.read()
+        else:
+            source = job.get("input", "")
+        output = io.BytesIO()
+        if prefix is None:
+            prog = proto.spawn(source, output)
+        else:
+            # continue after the shared prefix, see bf_program.prime()
+            prog = proto.fork(source, output)
+            for value in prefix:
+                prog.sink.write_byte(value)
+        prog.limits.update(limits or {})
+        start = time.perf_counter()
+        try:
+            if prefix is None:
+                result["exit"] = prog.run(backend, verbose=False)
+            else:
+                prog.resume()
+                result["exit"] = prog.data[prog.state["dp"]]
+        finally:
+            result["time"] = time.perf_counter() - start
+            result["steps"] = prog.steps
+            result["output"] = output.getvalue().decode("latin-1")
+    except Exception as err:
+        result["error"] = f"{type(err).__name__}: {err}"
+    return result
+
+
+def run_batch(jobs, backend="ir", workers=None, dialect=None, limits=None,
+              chunksize=4):
+    """Run many (program, input) jobs on a process pool.
+
+    jobs: iterable of dicts with "program" (path of a .b file), optional
+        "input" (str) or "input_file" (path) and an optional "id"
+    returns: generator of result dicts in job order, each with id,
+        program, output (latin-1 str), exit, steps, time or error
+
+    Every worker parses and compiles each program only once. On the "ir"
+    backend it also runs the program up to its first input only once and
+    forks every job from there, see bf_program.prime(). limits apply to
+    every job, see bf_program.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_batch_job, jobs, repeat(backend),
+                            repeat(dialect), repeat(limits),
+                            chunksize=chunksize)
+
+
+async def serve_tcp(prog, host="127.0.0.1", port=8023):
+    """Serve prog on a TCP port, one spawned instance per connection.
+
+    All sessions share one thread and one event loop. Every session runs
+    under prog.limits, set them for programs from untrusted clients.
+    """
+    import asyncio
+
+    async def session(reader, writer):
+        try:
+            await prog.spawn(b"", io.BytesIO()).run_async(reader, writer)
+        except (ConnectionError, bf_limit_error, IndexError, ValueError,
+                OverflowError):
+            # the session ends, the server goes on
+            pass
+        finally:
+            writer.close()
+
+    if not prog.ircode:
+        prog.compile_ir()
+    server = await asyncio.start_server(session, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+# sniffer candidates, each list in order of preference
+SNIFF_CHOICES = {
+                "EOF": [0, "unchanged", -1],
+                "cell_bits": [8, 16, 32],
+                "bounds": ["error", "extend"]
+                }
+
+
+def _sniff_job(prog, sample_input, dialect, steps):
+    """Trial run of prog under dialect in a worker, return its outcome."""
+    output = io.BytesIO()
+    trial = bf_program(prog, dialect=dialect, source=sample_input,
+                       sink=output, limits={"steps": steps})
+    outcome = {"dialect": dialect}
+    try:
+        trial.run(verbose=False)
+        outcome["status"] = "finished"
+    except bf_limit_error:
+        outcome["status"] = "limit"
+    except (IndexError, ValueError, OverflowError) as err:
+        outcome["status"] = f"{type(err).__name__}: {err}"
+    outcome["steps"] = trial.steps
+    outcome["output"] = output.getvalue().decode("latin-1")
+    return outcome
+
+
+def sniff_dialect(prog, sample_input=b"", steps=1000000, workers=None):
+    """Guess the dialect prog was written for from trial runs.
+
+    prog runs with sample_input under every combination of SNIFF_CHOICES,
+    in parallel worker processes with a budget of steps each. Runs that
+    finish beat runs that hit the budget, which beat runs that fail.
+    Among the best runs the most common output wins, ties go to the more
+    conventional dialect. A program that stays on the tape under the
+    "error" policy gets the cheaper "ignore" policy.
+
+    returns: suggested dialect dict, None if every run failed, list of
+        all run outcomes
+    """
+    candidates = [{"EOF": eof, "cell_bits": bits, "bounds": bounds}
+                  for eof in SNIFF_CHOICES["EOF"]
+                  for bits in SNIFF_CHOICES["cell_bits"]
+                  for bounds in SNIFF_CHOICES["bounds"]]
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        runs = list(pool.map(_sniff_job, repeat(prog), repeat(sample_input),
+                             candidates, repeat(steps)))
+
+    def rank(run):
+        return {"finished": 0, "limit": 1}.get(run["status"], 2)
+
+    best_rank = min(rank(run) for run in runs)
+    if best_rank == 2:
+        # no dialect runs it, failing runs say nothing about the dialect
+        return None, runs
+    best = [run for run in runs if rank(run) == best_rank]
+    # candidates are in order of preference, so are their runs
+    outputs = [run["output"] for run in best]
+    output = max(outputs, key=lambda out: (outputs.count(out),
+                                           -outputs.index(out)))
+    chosen = next(run for run in best if run["output"] == output)
+    dialect = bf_dialect(chosen["dialect"])
+    if best_rank == 0 and dialect["bounds"] == "error":
+        dialect["bounds"] = "ignore"
+    return dict(dialect), runs
+
+
+def cached_program(prog, dialect=None, **kwargs):
+    """Return a bf_program for prog, from the blob cache if possible.
+
+    Blobs live in CACHE_DIR, named by a hash of source, dialect and
+    optimizer version. A cache hit skips parsing and optimizing entirely,
+    a miss parses, optimizes and stores the blob for the next process.
+    kwargs go to bf_program.
+    """
+    import hashlib
+
+    program = bf_program(prog, dialect=dialect, **kwargs)
+    key = hashlib.sha256(json.dumps([prog, program.dialect,
+                                     OPTIMIZER_VERSION],
+                                    sort_keys=True).encode()).hexdigest()
+    path = os.path.join(CACHE_DIR, f"prog_{key[:32]}.bfb")
+    try:
+        return program.load_blob(path)
+    except (OSError, ValueError):
+        pass
+    program.parse_code()
+    program.compile_ir()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    program.save_blob(path)
+    return program
 
 
 def run_tests():
@@ -308,10 +3061,224 @@ def run_tests():
     testprog = bf_program(debugmode=True)
     print("Got one instance: ", type(testprog))
     print("Code currently is: ", testprog.codestr, "\n")
-    print(f"\n{testprog.check_codestr()} non-command characters in code.")
+    testprog.parse_code()
+    print(f"\n{testprog.cstats['num_char']['comment']} non-command "
+          "characters in code.")
     print(f"Return value: {testprog.run()}.")
     return None
 
 
+# command line commands and their help, see main()
+CLI_COMMANDS = {
+               "run": "run a program, raw input from stdin, raw output to "
+                      "stdout",
+               "batch": "run a manifest of jobs on a process pool, print "
+                        "JSONL results",
+               "serve": "serve a program over TCP, one session per "
+                        "connection",
+               "sniff": "guess the dialect of a program from trial runs, "
+                        "print JSON",
+               "monitor": "watch the shared tape of a program started with "
+                          "run --share"
+               }
+
+
+def _cli_options(command, parser):
+    """Add the options of one command line command to its parser."""
+    if command == "run":
+        parser.add_argument("program", help="brainfuck source file, '-' for "
+                            "stdin (then input only from --input)")
+        parser.add_argument("-i", "--input", default=None,
+                            help="input file instead of stdin")
+        parser.add_argument("-b", "--backend", default="ir",
+                            choices=["reference", "ir", "python", "c"])
+        parser.add_argument("--eof", default="0",
+                            choices=["0", "-1", "unchanged"],
+                            help="what ',' stores at end of input "
+                            "(default: 0)")
+        parser.add_argument("--linebreak", default="lf",
+                            choices=["lf", "crlf"])
+        parser.add_argument("--cell-bits", type=int, default=8,
+                            choices=bf_dialect.choices["cell_bits"])
+        parser.add_argument("--no-wrap", action="store_true",
+                            help="cell overflow is an error")
+        parser.add_argument("--bounds", default="ignore",
+                            choices=bf_dialect.choices["bounds"],
+                            help="data pointer policy (default: ignore)")
+        parser.add_argument("--len-data", type=int, default=30000,
+                            help="tape length in cells (default: 30000)")
+        parser.add_argument("--max-steps", type=int, default=None,
+                            help="abort after this many steps")
+        parser.add_argument("--nested", default=None,
+                            choices=["direct", "validate"],
+                            help="run guests of self-interpreters directly")
+        parser.add_argument("--cache", action="store_true",
+                            help="keep the parsed program in the blob cache")
+        parser.add_argument("--share", metavar="FILE", default=None,
+                            help="keep tape and state in FILE for monitor")
+    elif command == "batch":
+        parser.add_argument("manifest", help="JSONL file, one job per line, "
+                            "'-' for stdin")
+        parser.add_argument("-j", "--jobs", type=int, default=None,
+                            help="worker processes (default: all cores)")
+        parser.add_argument("-b", "--backend", default="ir",
+                            choices=["reference", "ir", "python", "c"])
+        parser.add_argument("--max-steps", type=int, default=None,
+                            help="abort jobs after this many steps")
+        parser.add_argument("--max-seconds", type=float, default=None,
+                            help="abort jobs after this much run time")
+    elif command == "serve":
+        parser.add_argument("program", help="brainfuck source file")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8023)
+        parser.add_argument("--max-steps", type=int, default=None,
+                            help="end sessions after this many steps")
+        parser.add_argument("--max-seconds", type=float, default=None,
+                            help="end sessions after this much run time")
+    elif command == "sniff":
+        parser.add_argument("program", help="brainfuck source file")
+        parser.add_argument("-i", "--input", default=None,
+                            help="file with sample input")
+        parser.add_argument("--steps", type=int, default=1000000,
+                            help="step budget per trial run")
+    elif command == "monitor":
+        parser.add_argument("file", help="shared tape file of run --share")
+        parser.add_argument("--interval", type=float, default=1.0,
+                            help="seconds between two reports (default: 1)")
+        parser.add_argument("--cells", type=int, default=16,
+                            help="cells shown from the data pointer on "
+                            "(default: 16)")
+
+
+def _run_command(args):
+    """Run one program for the command line, return the exit status."""
+    dialect = {
+              "EOF": (args.eof if args.eof == "unchanged"
+                      else int(args.eof)),
+              "linebreak": args.linebreak,
+              "len_data": args.len_data,
+              "cell_bits": args.cell_bits,
+              "cell_wrap": not args.no_wrap,
+              "bounds": args.bounds
+              }
+    if args.program == "-":
+        source = open(args.input, "rb") if args.input else b""
+        code = sys.stdin.buffer
+    else:
+        source = open(args.input, "rb") if args.input else None
+        code = args.program
+    limits = {"steps": args.max_steps}
+    try:
+        if args.cache:
+            if code is sys.stdin.buffer:
+                text = code.read().decode("latin-1")
+            else:
+                with open(code, encoding="latin-1") as progfile:
+                    text = progfile.read()
+            prog = cached_program(text or "\n", dialect, source=source,
+                                  limits=limits)
+        else:
+            # a placeholder, "" would be the built-in Hello World
+            prog = bf_program("\n", dialect=dialect, source=source,
+                              limits=limits)
+            if code is sys.stdin.buffer:
+                prog.parse_code(code)
+            else:
+                prog.parse_file(code)
+        if args.share:
+            prog.share_tape(args.share)
+        prog.run(args.backend, verbose=False, nested=args.nested)
+    except (OSError, ValueError, IndexError, RuntimeError) as err:
+        print(f"{sys.argv[0]}: {type(err).__name__}: {err}",
+              file=sys.stderr)
+        return 1
+    finally:
+        if hasattr(source, "close"):
+            source.close()
+    return 0
+
+
+def _monitor_command(args):
+    """Report a shared tape until its program stops, see tape_monitor."""
+    try:
+        monitor = tape_monitor(args.file)
+    except (OSError, ValueError) as err:
+        print(f"{sys.argv[0]}: {type(err).__name__}: {err}",
+              file=sys.stderr)
+        return 1
+    try:
+        while True:
+            state = monitor.state()
+            cells = monitor.tape_view(state["dp"], state["dp"] + args.cells)
+            print(f"ip {state['ip']} dp {state['dp']} steps "
+                  f"{state['steps']} output {state['output']}: "
+                  + " ".join(map(str, cells)), flush=True)
+            if not state["running"]:
+                return 0
+            if not monitor.alive():
+                print(f"{sys.argv[0]}: the program is gone", file=sys.stderr)
+                return 1
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        monitor.close()
+
+
+def main(argv=None):
+    """Command line interface, without a command run the module tests.
+
+    returns: exit status
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+    # only the command asked for is set up, all of them for help
+    argv = sys.argv[1:] if argv is None else argv
+    for name, help_text in CLI_COMMANDS.items():
+        if not argv or argv[0] not in CLI_COMMANDS or argv[0] == name:
+            _cli_options(name, commands.add_parser(name, help=help_text))
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        return _run_command(args)
+    elif args.command == "monitor":
+        return _monitor_command(args)
+    elif args.command == "sniff":
+        with open(args.program) as progfile:
+            prog = progfile.read()
+        sample_input = b""
+        if args.input:
+            with open(args.input, "rb") as infile:
+                sample_input = infile.read()
+        dialect, runs = sniff_dialect(prog, sample_input, args.steps)
+        print(json.dumps({"dialect": dialect, "runs": runs}, indent=1))
+        if dialect is None:
+            print(f"{sys.argv[0]}: every trial run failed, first: "
+                  f"{runs[0]['status']}", file=sys.stderr)
+            return 1
+    elif args.command == "serve":
+        import asyncio
+
+        limits = {"steps": args.max_steps, "seconds": args.max_seconds}
+        with open(args.program) as progfile:
+            prog = bf_program(progfile.read(), source=b"", sink=io.BytesIO(),
+                              limits=limits)
+        asyncio.run(serve_tcp(prog, args.host, args.port))
+    elif args.command == "batch":
+        manifest = (sys.stdin if args.manifest == "-"
+                    else open(args.manifest))
+        with manifest:
+            jobs = [json.loads(line) for line in manifest if line.strip()]
+        limits = {"steps": args.max_steps, "seconds": args.max_seconds}
+        for result in run_batch(jobs, args.backend, args.jobs,
+                                limits=limits):
+            print(json.dumps(result), flush=True)
+    else:
+        run_tests()
+    return 0
+
+
 if __name__ == "__main__":
-    run_tests()
+    sys.exit(main())
@@ -0,0 +1,381 @@
+"""Tests of iBrainfuck: every backend against the reference interpreter,
+and the tools around the engines.
+
+usage:
+    python -m pytest test_iBrainfuck.py
+"""
+
+import io
+import os
+
+import pytest
+
+import iBrainfuck
+
+PROG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prog")
+
+# (code, input, dialect or None), covering the folded start, loop idioms,
+# output folding and the checked dialects
+PROGRAMS = [
+           ("++++++++[>++++++++<-]>+.+.+.", b"", None),
+           (",[.,]", b"hello", None),
+           (",[->+>++<<]>.>.", b"\x05", None),
+           ("+++[>+++[>+<-]<-]>>.[-]+[>,.]", b"ab", None),
+           ("+>+>+>+<<<[>]<.", b"", None),
+           ("++<+++>>-<<.[-]<[.-]", b"", None),
+           ("<" * 30001 + ".", b"", None),
+           ("--[+++++++<---->>-->+>+>+<<<<]<.>++++[-<++++>>->--<<]>>-.",
+            b"", {"bounds": "wrap"}),
+           ("+<<>>+>-.<>", b"", {"bounds": "error", "len_data": 9}),
+           ("+[+<>]", b"", {"bounds": "error"}),
+           ("-+.", b"", {"cell_wrap": False}),
+           ("+>+[+]", b"", {"cell_wrap": False}),
+           ("+++[->++<]>.", b"", {"cell_wrap": False}),
+           ("-.>-.", b"", {"cell_bits": 16}),
+           (",.,.", b"a", {"EOF": 0}),
+           ("," + ">" * 29999 + "[->+<]+.", b"\x01", None),
+           (",>>>>[->+<]+.", b"", {"bounds": "error", "len_data": 5}),
+           ]
+
+
+def _run(code, inp, dialect, backend):
+    """Return output and exit value of a run, or the name of its error."""
+    output = io.BytesIO()
+    prog = iBrainfuck.bf_program(code, dialect=dialect, source=inp,
+                                 sink=output)
+    try:
+        exit_value = prog.run(backend, verbose=False)
+    except (IndexError, ValueError, OverflowError) as err:
+        return type(err).__name__
+    return output.getvalue(), exit_value
+
+
+def test_backends_match_reference():
+    for code, inp, dialect in PROGRAMS:
+        expected = _run(code, inp, dialect, "reference")
+        for backend in ("ir", "python", "c"):
+            assert _run(code, inp, dialect, backend) == expected, (
+                    code, dialect, backend)
+
+
+def test_lanes_match_reference():
+    code = ",[>+<-]>[<+>-]<[.-]"
+    inputs = [b"", b"\x01", b"\x05", b"\x03"]
+    prog = iBrainfuck.bf_program(code)
+    for inp, result in zip(inputs, prog.run_lanes(inputs)):
+        assert (result["output"], result["exit"]) == _run(
+                code, inp, None, "reference")
+
+
+def test_blob_with_tape(tmp_path):
+    path = str(tmp_path / "prog.blob")
+    for bits in (8, 16, 32, 64):
+        prog = iBrainfuck.bf_program("+>+>+<<.", dialect={"cell_bits": bits,
+                                                          "len_data": 8})
+        prog.data[0] = (1 << bits) - 2
+        prog.save_blob(path, tape=True)
+        loaded = iBrainfuck.bf_program().load_blob(path)
+        assert list(loaded.data) == list(prog.data)
+        for backend in ("reference", "ir", "python", "c"):
+            output = io.BytesIO()
+            loaded = iBrainfuck.bf_program(sink=output).load_blob(path)
+            assert loaded.run(backend, verbose=False) == (1 << bits) - 1
+            assert output.getvalue() == b"\xff"
+
+
+def test_batch_ir_output():
+    program = os.path.join(PROG_DIR, "jabh.b")
+    with open(program) as progfile:
+        expected = _run(progfile.read(), b"", None, "reference")[0]
+    jobs = [{"id": 1, "program": program}, {"id": 2, "program": program}]
+    results = list(iBrainfuck.run_batch(jobs, "ir", workers=1))
+    assert [result["output"].encode("latin-1") for result in results] == [
+            expected, expected]
+
+
+def test_limits_on_every_backend():
+    for backend in ("reference", "ir", "python", "c"):
+        prog = iBrainfuck.bf_program("+[]", limits={"steps": 1000})
+        with pytest.raises(iBrainfuck.bf_limit_error):
+            prog.run(backend, verbose=False)
+    prog = iBrainfuck.bf_program("+[]", limits={"steps": 1000})
+    with pytest.raises(iBrainfuck.bf_limit_error):
+        prog.run(profile=True, verbose=False)
+
+
+def test_resume_after_limit():
+    code = "+[>+[-]>+<<+]>>."
+    prog = iBrainfuck.bf_program(code, dialect={"cell_bits": 16},
+                                 sink=io.BytesIO(), limits={"steps": 20000})
+    with pytest.raises(iBrainfuck.bf_limit_error):
+        prog.resume()
+    assert prog.state["steps"] == prog.steps > 0
+    prog.limits["steps"] = None
+    assert prog.resume()
+    assert list(prog.data[:3]) == [0, 0, 65535]
+
+
+def test_monitor_after_failed_run(tmp_path):
+    path = str(tmp_path / "tape")
+    # the IR engine stops at a back edge, the others within the body
+    for backend, profile, dp in (("ir", False, 0), ("reference", False, 1),
+                                 ("reference", True, 1)):
+        prog = iBrainfuck.bf_program("+[>+<]", sink=io.BytesIO(),
+                                     limits={"steps": 300000})
+        prog.share_tape(path)
+        with pytest.raises(iBrainfuck.bf_limit_error):
+            prog.run(backend, verbose=False, profile=profile)
+        monitor = iBrainfuck.tape_monitor(path)
+        state = monitor.state()
+        assert monitor.tape_view(0, 2)[0] == 1
+        monitor.close()
+        assert not state["running"]
+        assert state["steps"] == prog.steps >= 300000
+        assert state["dp"] == dp
+
+
+def test_profile_of_spawned_program():
+    prog = iBrainfuck.bf_program("ab ++[->+<] cd >.", sink=io.BytesIO())
+    prog.parse_code()
+    child = prog.spawn(sink=io.BytesIO())
+    child.run(profile=True, verbose=False)
+    profile = child.profile_data()
+    assert profile["steps"] == 15
+    assert [(loop["offset"], loop["end_offset"], loop["iterations"])
+            for loop in profile["loops"]] == [(5, 10, 2)]
+    assert "5-10" in child.profile_report()
+    assert child.set_breakpoint(15) == prog.set_breakpoint(15) == 8
+
+
+def test_serve_sessions_end_at_limits():
+    import asyncio
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    # echo, then loop forever
+    prog = iBrainfuck.bf_program(",[.,]+[]", source=b"", sink=io.BytesIO(),
+                                 limits={"steps": 100000})
+
+    async def client():
+        server = asyncio.create_task(iBrainfuck.serve_tcp(prog, port=port))
+        for attempt in range(100):
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1",
+                                                               port)
+                break
+            except OSError:
+                await asyncio.sleep(0.01)
+        writer.write(b"hi")
+        writer.write_eof()
+        echoed = await asyncio.wait_for(reader.read(), 10)
+        writer.close()
+        server.cancel()
+        return echoed
+
+    assert asyncio.run(client()) == b"hi"
+
+
+def test_output_folded_into_write_ops():
+    # the start and a run after input print known cells
+    code = "++++++++[>++++++++<-]>+.+.+.,[-]++++++++++.+."
+    prog = iBrainfuck.bf_program(code)
+    prog.compile_ir()
+    analysis = prog.cstats["analysis"]
+    assert analysis["write_ops"] == 2
+    assert analysis["output_ops"] == 5
+    assert not any(op == iBrainfuck.OP_OUT for op, arg, arg2 in prog.ircode)
+    assert _run(code, b"x", None, "ir") == _run(code, b"x", None,
+                                                 "reference")
+
+
+def test_sniff_dialect():
+    dialect, runs = iBrainfuck.sniff_dialect("+++.", workers=2)
+    assert (dialect["cell_bits"], dialect["bounds"]) == (8, "ignore")
+    dialect, runs = iBrainfuck.sniff_dialect("+[.", workers=2)
+    assert dialect is None
+    assert all(run["status"].startswith("ValueError") for run in runs)
+
+
+def test_debugger_steps_back_and_replays(monkeypatch):
+    monkeypatch.setattr(iBrainfuck, "CHECKPOINT_INTERVAL", 7)
+    prog = iBrainfuck.bf_program("+++[>++<-]>.,.", source=b"a")
+    debugger = iBrainfuck.bf_debugger(prog)
+    assert debugger.run() == "end"
+    assert (bytes(debugger.output), debugger.steps) == (b"\x06a", 26)
+    # beyond the undo log, from a checkpoint
+    assert debugger.step_back(20) == 20
+    fresh = iBrainfuck.bf_debugger(iBrainfuck.bf_program("+++[>++<-]>.,."))
+    fresh.run(max_steps=6)
+    assert (debugger.ip, debugger.dp, list(prog.data[:2])) == (
+            fresh.ip, fresh.dp, list(fresh.program.data[:2]))
+    # input is replayed, not read again
+    assert debugger.run() == "end"
+    assert bytes(debugger.output) == b"\x06a"
+    assert debugger.run_back() == "start"
+    assert (debugger.steps, list(prog.data[:2])) == (0, [0, 0])
+
+
+def test_debugger_failed_step():
+    prog = iBrainfuck.bf_program("+++<", dialect={"bounds": "error"})
+    debugger = iBrainfuck.bf_debugger(prog)
+    with pytest.raises(IndexError):
+        debugger.run()
+    assert (debugger.steps, debugger.ip) == (3, 3)
+    debugger.step_back()
+    assert (debugger.steps, debugger.ip, debugger.cell()) == (2, 2, 2)
+
+
+def test_snapshot_and_restore():
+    for dialect in (None, {"bounds": "extend"}, {"cell_bits": 16}):
+        output = io.BytesIO()
+        # input first, so nothing is folded ahead of the run
+        prog = iBrainfuck.bf_program(",[>+++[>+<-]<-]>>.", dialect=dialect,
+                                     source=b"\xc8", sink=output)
+        prog.compile_ir()
+        assert not prog.resume(500)
+        snapshot = prog.snapshot()
+        assert prog.resume()
+        end = (prog.steps, list(prog.data[:3]))
+        for again in range(2):
+            prog.restore(snapshot)
+            assert prog.resume()
+            assert (prog.steps, list(prog.data[:3])) == end
+        # output is not rewound, every run wrote it once
+        assert output.getvalue() == b"X" * 3
+
+
+def test_prime_and_fork():
+    prog = iBrainfuck.bf_program("++++++++[>++++++++<-]>+.,[.,]",
+                                 sink=io.BytesIO())
+    assert prog.prime() == b"A"
+    outputs = []
+    for inp in (b"xy", b"", b"z"):
+        output = io.BytesIO()
+        child = prog.fork(inp, output)
+        assert child.resume()
+        outputs.append(output.getvalue())
+    assert outputs == [b"xy", b"", b"z"]
+    # the forks did not touch the primed program
+    assert prog.fork(b"q", io.BytesIO()).resume()
+    assert prog.state["pc"] < len(prog.ircode)
+
+
+def test_chunked_parsing(tmp_path, monkeypatch):
+    source = "a ++[>+ b<-]>.\n[c[-]d]e,."
+    whole = iBrainfuck.bf_program(source)
+    whole.parse_code()
+    tables = (whole.cleancode, list(whole.jumps), list(whole.codepos),
+              list(whole.brackets), whole.cstats["num_char"])
+
+    def parsed(prog):
+        return (prog.cleancode, list(prog.jumps), list(prog.codepos),
+                list(prog.brackets), prog.cstats["num_char"])
+
+    for size in range(1, 8):
+        prog = iBrainfuck.bf_program()
+        prog.parse_code(source[start:start + size].encode("latin-1")
+                        for start in range(0, len(source), size))
+        assert parsed(prog) == tables
+    monkeypatch.setattr(iBrainfuck, "PARSE_CHUNK_SIZE", 3)
+    path = tmp_path / "prog.b"
+    path.write_text(source)
+    prog = iBrainfuck.bf_program()
+    prog.parse_file(str(path))
+    assert parsed(prog) == tables
+    prog = iBrainfuck.bf_program()
+    prog.parse_code(io.BytesIO(source.encode()))
+    assert parsed(prog) == tables
+
+
+def test_unmatched_bracket_offsets():
+    for source, message in (("ab ]", "unmatched ] at offset 3"),
+                            ("x[ [ ]", "unmatched [ at offset 1"),
+                            ("[]\n\n[[]", "unmatched [ at offset 4")):
+        with pytest.raises(ValueError) as error:
+            iBrainfuck.bf_program(source).parse_code()
+        assert str(error.value) == message
+
+
+def test_breakpoints_and_watchpoints():
+    for backend in ("reference", "ir", "c"):
+        output = io.BytesIO()
+        prog = iBrainfuck.bf_program("++#[>+<-]#>.", sink=output)
+        events = []
+        prog.on_trap = events.append
+        assert prog.add_marker_breakpoints() == 2
+        prog.set_watchpoint(1, 2)
+        assert prog.run(backend, verbose=False) == 2
+        assert [(event["reason"], event["offset"], event["dp"],
+                 event["value"], event["steps"]) for event in events] == [
+                ("breakpoint", 3, 0, 2, 2), ("watchpoint", 5, 1, 2, 10),
+                ("breakpoint", 10, 0, 0, 13)]
+        events.clear()
+        prog.set_watchpoint(1)
+        prog.breakpoints.clear()
+        prog.data[1] = 0
+        prog.run(backend, verbose=False)
+        assert [event["value"] for event in events] == [1, 2]
+        prog.clear_traps()
+        prog.run(backend, verbose=False)
+        assert len(events) == 2
+        # the last run adds to the cell the previous one left
+        assert output.getvalue() == b"\x02\x02\x04"
+
+
+def test_nested_guest_runs_directly():
+    with open(os.path.join(PROG_DIR, "dbfi.b")) as progfile:
+        interpreter = progfile.read()
+    results = {}
+    for nested in (None, "direct", "validate"):
+        output = io.BytesIO()
+        prog = iBrainfuck.bf_program(interpreter, source=b",[.,]!hi",
+                                     sink=output)
+        prog.run(verbose=False, nested=nested)
+        results[nested] = (output.getvalue(), prog.steps)
+    assert {output for output, steps in results.values()} == {b"hi"}
+    # the guest ran on its own, not through the interpreter
+    assert results["direct"][1] < results[None][1] / 10
+    guest = iBrainfuck.bf_program(interpreter, source=b"+.").guest_program()
+    assert guest is None
+
+
+def test_shared_tape(tmp_path):
+    path = str(tmp_path / "tape")
+    prog = iBrainfuck.bf_program("++>+++>,.", dialect={"cell_bits": 16},
+                                 source=b"a", sink=io.BytesIO())
+    prog.share_tape(path)
+    monitor = iBrainfuck.tape_monitor(path)
+    assert monitor.state()["steps"] == -1
+    prog.run(verbose=False)
+    assert monitor.alive()
+    assert monitor.tape_view(0, 3) == [2, 3, 97]
+    state = monitor.state()
+    assert (state["running"], state["dp"], state["output"]) == (0, 2, 1)
+    # the program's tape is the file
+    prog.data[0] = 500
+    assert monitor.tape_view(0, 1) == [500]
+    monitor.close()
+    with pytest.raises(ValueError):
+        iBrainfuck.tape_monitor(os.path.join(PROG_DIR, "e.b"))
+
+
+def test_run_async_with_queues():
+    import asyncio
+
+    async def session():
+        reader, writer = asyncio.Queue(), asyncio.Queue()
+        prog = iBrainfuck.bf_program(",[.,]", source=b"", sink=io.BytesIO())
+        task = asyncio.create_task(prog.run_async(reader, writer,
+                                                  slice_steps=10))
+        await reader.put(b"ab")
+        await reader.put("cd")
+        await reader.put(None)
+        await task
+        chunks = []
+        while not writer.empty():
+            chunks.append(writer.get_nowait())
+        return b"".join(chunks)
+
+    assert asyncio.run(session()) == b"abcd"